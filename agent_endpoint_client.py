@@ -2,19 +2,181 @@
 Client for calling Databricks Agent Endpoint via MLflow Deployments
 Uses MLflow client which handles auth automatically via WorkspaceClient
 """
+import asyncio
+import functools
 import json
+import logging
 import os
 import time
+import traceback
+import uuid
+from itertools import islice
+from operator import itemgetter
 from typing import Dict, Any
+import aiohttp
+import ijson
+import orjson
 import requests
 from mlflow.deployments import get_deploy_client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Extra headers for streaming requests; some SSE proxies only stop buffering
+# when the client explicitly asks for an event stream. Accept-Encoding is left to
+# requests and aiohttp, which already negotiate gzip by default
+_STREAM_HEADERS = {"Accept": "text/event-stream"}
+
+# Streaming timeouts: fail fast on a stuck connect, bound the silence between
+# reads, and abort streams that keep trickling bytes without completing an event
+_STREAM_CONNECT_TIMEOUT = 10
+_STREAM_READ_TIMEOUT = 60
+_STREAM_STALL_TIMEOUT = 120
+
+# Read size for SSE responses without chunked transfer encoding
+_NON_CHUNKED_READ_SIZE = 64
+
+# SSE field prefix and end-of-stream marker, compared as raw bytes so lines
+# are never decoded just to be inspected
+_DATA_PREFIX = b"data: "
+_DONE = b"[DONE]"
+
+# Cell accessor for Genie statement results
+_get_string_value = itemgetter("string_value")
+
+# Nested Genie content larger than this (in characters) is stream-parsed with
+# ijson instead of being materialized as a full JSON tree
+_GENIE_STREAM_THRESHOLD = 1_000_000
+
+# Sentinel returned by _parse_sse_data when the stream signals completion
+_STREAM_DONE = object()
+
+
+def _json_loads(data):
+    """
+    Decode JSON with orjson, falling back to the stdlib parser for the NaN and
+    Infinity tokens Python's json.dumps writes but orjson rejects
+
+    Raises:
+        json.JSONDecodeError: If neither parser accepts the input
+    """
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data)
+
+
+class _SSEParser:
+    """
+    Incremental Server-Sent Events parser fed with raw bytes
+
+    Events are emitted as soon as their terminating blank line arrives, so
+    callers don't wait on line buffering in the HTTP client.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data_lines = []
+        self._pending = []
+        self._last_event_at = time.monotonic()
+
+    def feed(self, chunk: bytes):
+        """Append raw bytes and process every complete line in the buffer"""
+        self._buffer += chunk
+        start = 0
+        while (end := self._buffer.find(b"\n", start)) != -1:
+            line = bytes(self._buffer[start:end])
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            self._process_line(line)
+            start = end + 1
+        del self._buffer[:start]
+
+    def close(self):
+        """
+        Flush at end of stream: process a trailing line without a newline and
+        dispatch any data lines still waiting for their blank line
+        """
+        if self._buffer:
+            line = bytes(self._buffer)
+            self._buffer.clear()
+            self._process_line(line.rstrip(b"\r"))
+        self._process_line(b"")
+
+    def check_stall(self, timeout: float):
+        """Raise TimeoutError if no event or keep-alive has arrived within timeout seconds"""
+        if time.monotonic() - self._last_event_at > timeout:
+            raise TimeoutError(f"No events or keep-alives received from agent stream for {timeout}s")
+
+    def events(self):
+        """Yield the events completed since the last call as {"data": b"..."} dicts"""
+        pending, self._pending = self._pending, []
+        yield from pending
+
+    def _process_line(self, line: bytes):
+        # A blank line dispatches the accumulated event
+        if not line:
+            if self._data_lines:
+                self._pending.append({"data": b"\n".join(self._data_lines)})
+                self._data_lines = []
+                self._last_event_at = time.monotonic()
+            return
+
+        # Fast path for the common "data: ..." line
+        if line.startswith(_DATA_PREFIX):
+            self._data_lines.append(line[len(_DATA_PREFIX):])
+            return
+
+        # Comment lines are keep-alives: the server is alive (e.g. waiting on a
+        # long Genie query), so they reset the stall watchdog without an event
+        if line.startswith(b":"):
+            self._last_event_at = time.monotonic()
+            return
+
+        field, _, value = line.partition(b":")
+        if value.startswith(b" "):
+            value = value[1:]
+
+        # Only data fields are used by the agent stream; event/id/retry are ignored
+        if field == b"data":
+            self._data_lines.append(value)
+
+
+@functools.lru_cache(maxsize=4)
+def _get_cached_deploy_client(target: str = "databricks"):
+    """Return a shared MLflow deployments client so re-created AgentEndpointClients skip the auth handshake"""
+    return get_deploy_client(target)
+
+
+def _extract_message_text(item: dict) -> str:
+    """Extract text from a message item with nested content"""
+    content = item.get("content", "")
 
+    # Content as string
+    if isinstance(content, str):
+        return content
+
+    # Content as list of objects with 'text' field
+    if isinstance(content, list) and content:
+        first_item = content[0]
+        if isinstance(first_item, dict):
+            return first_item.get("text", "")
+
+    return ""
+
+
+# Text extractors keyed by output item type
+_TEXT_EXTRACTORS = {
+    "text": lambda item: item.get("text", ""),
+    "message": _extract_message_text,
+}
 
 
 class AgentEndpointClient:
     """Client for calling Databricks Agent Endpoint via MLflow Deployments"""
 
-    def __init__(self, agent_endpoint_name: str = None, workspace_client=None, endpoint_url: str = None, access_token: str = None):
+    def __init__(self, agent_endpoint_name: str = None, workspace_client=None, endpoint_url: str = None, access_token: str = None, max_table_rows: int = None):
         """
         Initialize agent endpoint client
 
@@ -23,19 +185,154 @@ class AgentEndpointClient:
             workspace_client: Databricks WorkspaceClient instance (optional if endpoint_url provided)
             endpoint_url: Direct HTTP URL to the agent endpoint (optional)
             access_token: Databricks access token for authentication (optional)
+            max_table_rows: Maximum number of Genie table rows to keep (optional, default all)
         """
         # Support both MLflow Deployments and direct HTTP access
         self.use_direct_http = bool(endpoint_url)
+        self.max_table_rows = max_table_rows
+
+        # aiohttp sessions are bound to the event loop they are created in,
+        # so the shared session is created lazily by _get_aio_session()
+        self._aio_session = None
+        self._aio_loop = None
+        self._session = None
+        self._headers = None
+
+        # Parts of the streaming payload that never vary between requests
+        self._payload_template = {
+            "databricks_options": {
+                "return_trace": True
+            },
+            "stream": True
+        }
         
         if self.use_direct_http:
             self.endpoint_url = endpoint_url
             self.access_token = access_token
-            print(f"[AgentClient] Initialized with direct HTTP endpoint: {endpoint_url}")
+            self._headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json",
+            }
+
+            # Reuse one keep-alive connection pool across chat turns instead of
+            # paying DNS + TLS setup on every request. Agent calls aren't idempotent
+            # (they run Genie queries and write to session memory), so only retry
+            # failures to connect, where the request never reached the endpoint
+            self._session = requests.Session()
+            self._session.mount(
+                "https://",
+                HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=8,
+                    max_retries=Retry(
+                        total=2,
+                        connect=2,
+                        read=0,
+                        status=0,
+                        other=0,
+                        backoff_factor=0.3,
+                    ),
+                ),
+            )
+            self._session.headers.update(self._headers)
+            logger.info("Initialized with direct HTTP endpoint: %s", endpoint_url)
         else:
             self.agent_endpoint_name = agent_endpoint_name
-            self.deploy_client = get_deploy_client("databricks")
-            print(f"[AgentClient] Initialized with MLflow endpoint: {agent_endpoint_name}")
+            self.deploy_client = _get_cached_deploy_client("databricks")
+            logger.info("Initialized with MLflow endpoint: %s", agent_endpoint_name)
     
+    def close(self):
+        """Close the pooled HTTP session"""
+        if self._session is not None:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _build_stream_payload(self, user_message: str, user_email: str = None, session_id: str = None) -> dict:
+        """Build the Databricks playground-format payload for a streaming request"""
+        # Generate conversation ID
+        conversation_id = uuid.uuid4().hex
+
+        return {
+            **self._payload_template,
+            "input": [{"role": "user", "content": user_message}],
+            "custom_inputs": {
+                "conversation_id": conversation_id,
+                "user_id": user_email or "anonymous@crunchyroll.com",
+                "session_id": session_id,  # Pass app session ID to agent
+                "user_token": self.access_token  # Pass user token for Genie API auth
+            },
+        }
+
+    def _parse_sse_data(self, data: bytes):
+        """
+        Parse the data of a single Server-Sent Event from the agent stream
+
+        Returns:
+            The trace or final-response object to yield, _STREAM_DONE on the
+            [DONE] marker, or None if the event carries nothing to yield
+        """
+        try:
+            # Check for [DONE] marker
+            if data == _DONE:
+                logger.debug("Stream completed")
+                return _STREAM_DONE
+
+            try:
+                chunk_data = _json_loads(data)
+            except json.JSONDecodeError as e:
+                logger.debug("JSON decode error: %s", e)
+                return None
+
+            # Extract delta from response.output_text.delta events
+            if chunk_data.get("type") != "response.output_text.delta":
+                return None
+
+            delta = chunk_data.get("delta", "")
+            if not delta:
+                return None
+
+            try:
+                # Parse delta as JSON
+                obj = _json_loads(delta)
+            except json.JSONDecodeError:
+                # Delta is not JSON, skip
+                return None
+
+            # Traces
+            if obj.get("type") == "trace":
+                logger.debug("Trace: %s - %s", obj.get("step"), obj.get("status"))
+                return obj
+
+            # Final response
+            if "response" in obj:
+                logger.debug("Final response received")
+                return obj
+
+            return None
+
+        except Exception as e:
+            logger.warning("Error processing event: %s", e)
+            return None
+
+    def _drain_events(self, parser: _SSEParser):
+        """
+        Convert the events completed in the parser into trace/final-response objects
+
+        Yields:
+            Parsed objects, ending with _STREAM_DONE if the [DONE] marker was seen
+        """
+        for event in parser.events():
+            obj = self._parse_sse_data(event["data"])
+            if obj is not None:
+                yield obj
+            if obj is _STREAM_DONE:
+                return
+
     def query_stream(self, user_message: str, user_email: str = None, session_id: str = None):
         """
         Stream response from agent endpoint with trace events support.
@@ -46,128 +343,224 @@ class AgentEndpointClient:
             session_id: App-level session ID for conversation grouping
             
         Yields:
-            JSON strings containing either trace events or final response
+            UTF-8 JSON bytes containing either trace events or final response
         """
-        print(f"[AgentClient] Streaming message to agent endpoint...")
-        print(f"[AgentClient] User: {user_email}")
-        print(f"[AgentClient] Session ID: {session_id}")
+        logger.debug("Streaming message to agent endpoint...")
+        logger.debug("User: %s", user_email)
+        logger.debug("Session ID: %s", session_id)
         
         try:
             if not self.use_direct_http:
-                print(f"[AgentClient] ERROR: Streaming only supported with direct HTTP access")
+                logger.error("Streaming only supported with direct HTTP access")
                 error_response = {
                     "response": "Streaming not supported with MLflow Deployments client",
                     "charts": [],
                     "table_data": None,
                     "error": "Use direct HTTP endpoint URL for streaming"
                 }
-                yield json.dumps(error_response)
+                yield orjson.dumps(error_response)
                 return
             
-            # Generate conversation ID
-            import uuid
-            conversation_id = str(uuid.uuid4())
-            
             # Direct HTTP call to agent endpoint with streaming
            
             # decoded_token = jwt.decode(self.access_token, options={"verify_signature": False})
             # print(f"token used for calling endpooint {decoded_token}")
-            headers = {
-                "Authorization": f"Bearer {self.access_token}",
-                "Content-Type": "application/json",
-            }
+            # Serialize once with orjson and send the bytes as-is
+            body = orjson.dumps(self._build_stream_payload(user_message, user_email, session_id))
             
-            # Databricks playground format
-            payload = {
-                "input": [{"role": "user", "content": user_message}],
-                "custom_inputs": {
-                    "conversation_id": conversation_id,
-                    "user_id": user_email or "anonymous@crunchyroll.com",
-                    "session_id": session_id,  # Pass app session ID to agent
-                    "user_token": self.access_token  # Pass user token for Genie API auth
-                },
-                "databricks_options": {
-                    "return_trace": True
-                },
-                "stream": True
-            }
-            
-            print(f"[AgentClient] Making streaming HTTP POST to {self.endpoint_url}")
-            print(f"[AgentClient] Payload: {json.dumps(payload)}")
+            logger.debug("Making streaming HTTP POST to %s", self.endpoint_url)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Payload: %s", body.decode())
             
-            response = requests.post(
+            # Closing the response on exit hands the connection back to the pool
+            with self._session.post(
                 self.endpoint_url,
-                headers=headers,
-                json=payload,
+                headers=_STREAM_HEADERS,
+                data=body,
                 stream=True,  # Enable streaming
-                timeout=300
-            )
-            
-            print(f"[AgentClient] Response status code: {response.status_code}")
-            response.raise_for_status()
-            
-            # Process Server-Sent Events (SSE) stream
-            print(f"[AgentClient] Processing SSE stream")
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        decoded_line = line.decode('utf-8').strip()
-                        
-                        # Skip empty lines
-                        if not decoded_line:
-                            continue
-                        
-                        # Handle SSE format: "data: {json}"
-                        if decoded_line.startswith('data: '):
-                            json_str = decoded_line[6:]  # Remove "data: " prefix
-                            
-                            # Check for [DONE] marker
-                            if json_str == '[DONE]':
-                                print(f"[AgentClient] Stream completed")
-                                break
-                            
-                            try:
-                                chunk_data = json.loads(json_str)
-                                
-                                # Extract delta from response.output_text.delta events
-                                if chunk_data.get("type") == "response.output_text.delta":
-                                    delta = chunk_data.get("delta", "")
-                                    if delta:
-                                        try:
-                                            # Parse delta as JSON
-                                            obj = json.loads(delta)
-                                            
-                                            # Yield traces
-                                            if obj.get("type") == "trace":
-                                                print(f"[AgentClient] Trace: {obj.get('step')} - {obj.get('status')}")
-                                                yield json.dumps(obj)
-                                                time.sleep(0.1)  # Small delay for visual effect
-                                            
-                                            # Yield final response
-                                            elif "response" in obj:
-                                                print(f"[AgentClient] Final response received")
-                                                yield json.dumps(obj)
-                                        
-                                        except json.JSONDecodeError:
-                                            # Delta is not JSON, skip
-                                            pass
-                                
-                            except json.JSONDecodeError as e:
-                                print(f"[AgentClient] JSON decode error: {e}")
-                                continue
-                        
-                    except Exception as e:
-                        print(f"[AgentClient] Error processing line: {e}")
-                        continue
+                timeout=(_STREAM_CONNECT_TIMEOUT, _STREAM_READ_TIMEOUT)
+            ) as response:
+                logger.debug("Response status code: %s", response.status_code)
+                response.raise_for_status()
+
+                # Process Server-Sent Events (SSE) stream, feeding raw bytes to
+                # the parser as soon as they arrive
+                logger.debug("Processing SSE stream")
+                # Decompress in urllib3 as bytes arrive rather than buffering a
+                # gzip'd stream. chunk_size=None hands over each HTTP chunk as soon
+                # as it lands, but on a non-chunked body it would read to EOF, so
+                # fall back to small reads there.
+                response.raw.decode_content = True
+                chunk_size = None if response.raw.chunked else _NON_CHUNKED_READ_SIZE
+
+                parser = _SSEParser()
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    parser.feed(chunk)
+                    parser.check_stall(_STREAM_STALL_TIMEOUT)
+                    for obj in self._drain_events(parser):
+                        if obj is _STREAM_DONE:
+                            return
+
+                        yield orjson.dumps(obj)
+
+                # The server may close without a final blank line
+                parser.close()
+                for obj in self._drain_events(parser):
+                    if obj is _STREAM_DONE:
+                        return
+
+                    yield orjson.dumps(obj)
         
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, TimeoutError) as e:
             error_response = {
                 "response": f"Connection error: {str(e)}",
                 "charts": [],
                 "table_data": None,
                 "error": str(e)
             }
-            yield json.dumps(error_response)
+            yield orjson.dumps(error_response)
+
+    async def _get_aio_session(self) -> aiohttp.ClientSession:
+        """Return the shared aiohttp session for the running event loop, creating it if needed"""
+        loop = asyncio.get_running_loop()
+        if self._aio_session is None or self._aio_session.closed or self._aio_loop is not loop:
+            self._aio_session = aiohttp.ClientSession(
+                headers=self._headers,
+                timeout=aiohttp.ClientTimeout(total=300)
+            )
+            self._aio_loop = loop
+        return self._aio_session
+
+    async def aclose(self):
+        """Close the shared aiohttp session"""
+        if self._aio_session is not None and not self._aio_session.closed:
+            await self._aio_session.close()
+        self._aio_session = None
+        self._aio_loop = None
+
+    async def query_stream_async(self, user_message: str, user_email: str = None, session_id: str = None):
+        """
+        Async variant of query_stream that does not block the event loop while
+        waiting on the agent.
+
+        Args:
+            user_message: User's question
+            user_email: User's email for session tracking
+            session_id: App-level session ID for conversation grouping
+
+        Yields:
+            UTF-8 JSON bytes containing either trace events or final response
+        """
+        logger.debug("Streaming message to agent endpoint (async)...")
+        logger.debug("User: %s", user_email)
+        logger.debug("Session ID: %s", session_id)
+
+        if not self.use_direct_http:
+            logger.error("Streaming only supported with direct HTTP access")
+            error_response = {
+                "response": "Streaming not supported with MLflow Deployments client",
+                "charts": [],
+                "table_data": None,
+                "error": "Use direct HTTP endpoint URL for streaming"
+            }
+            yield orjson.dumps(error_response)
+            return
+
+        body = orjson.dumps(self._build_stream_payload(user_message, user_email, session_id))
+
+        try:
+            session = await self._get_aio_session()
+            logger.debug("Making streaming HTTP POST to %s", self.endpoint_url)
+
+            async with session.post(
+                self.endpoint_url,
+                headers=_STREAM_HEADERS,
+                data=body,
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=_STREAM_CONNECT_TIMEOUT,
+                    sock_read=_STREAM_READ_TIMEOUT,
+                ),
+            ) as response:
+                logger.debug("Response status code: %s", response.status)
+                response.raise_for_status()
+
+                parser = _SSEParser()
+                async for chunk in response.content.iter_any():
+                    parser.feed(chunk)
+                    parser.check_stall(_STREAM_STALL_TIMEOUT)
+                    for obj in self._drain_events(parser):
+                        if obj is _STREAM_DONE:
+                            return
+
+                        yield orjson.dumps(obj)
+
+                # The server may close without a final blank line
+                parser.close()
+                for obj in self._drain_events(parser):
+                    if obj is _STREAM_DONE:
+                        return
+
+                    yield orjson.dumps(obj)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_response = {
+                "response": f"Connection error: {str(e)}",
+                "charts": [],
+                "table_data": None,
+                "error": str(e)
+            }
+            yield orjson.dumps(error_response)
+
+    def _build_chat_inputs(self, user_message: str, user_email: str = None, session_id: str = None) -> dict:
+        """Build the non-streaming request body shared by the HTTP and MLflow paths"""
+        # Prepare custom inputs with user information
+        custom_inputs = {}
+        if user_email:
+            custom_inputs["user_id"] = user_email
+        
+        # Use provided session_id from app (created by AppSessionManager)
+        if session_id:
+            custom_inputs["session_id"] = session_id
+        elif user_email:
+            # Fallback only if no session_id provided
+            custom_inputs["session_id"] = f"session_{user_email}"
+
+        # Agent endpoint expects "input" (array of messages), not "messages"
+        inputs = {"input": [{"role": "user", "content": user_message}]}
+        
+        # Add custom_inputs if present
+        if custom_inputs:
+            inputs["custom_inputs"] = custom_inputs
+
+        return inputs
+
+    def _build_chat_result(self, response_data: dict) -> Dict[str, Any]:
+        """Log and parse a raw non-streaming agent response"""
+        logger.debug("Received response from agent endpoint")
+        logger.debug("Raw response type: %s", type(response_data))
+        logger.debug(
+            "Raw response keys: %s", response_data.keys() if isinstance(response_data, dict) else "Not a dict"
+        )
+        if isinstance(response_data, dict) and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response sample: %s", str(response_data)[:500])
+
+        # Parse agent response
+        result = self._parse_agent_response(response_data)
+        logger.debug(
+            "Parsed response: %d charts, table_data: %s", len(result.get("charts", [])), bool(result.get("table_data"))
+        )
+
+        return result
+
+    def _error_result(self, error_msg: str) -> Dict[str, Any]:
+        """Build the result dict returned when an agent call fails"""
+        return {
+            "response": None,
+            "messages": [],
+            "charts": [],
+            "table_data": None,
+            "error": error_msg,
+        }
 
     def chat(self, user_message: str, user_email: str = None, session_id: str = None) -> Dict[str, Any]:
         """
@@ -181,117 +574,158 @@ class AgentEndpointClient:
         Returns:
             Dict with 'response', 'messages', 'charts', 'table_data', and 'error' keys
         """
-        print(f"[AgentClient] Sending message to agent endpoint...")
-        print(f"[AgentClient] User: {user_email}")
-        print(f"[AgentClient] Session ID: {session_id}")
+        logger.debug("Sending message to agent endpoint...")
+        logger.debug("User: %s", user_email)
+        logger.debug("Session ID: %s", session_id)
 
         try:
-            # Prepare custom inputs with user information
-            custom_inputs = {}
-            if user_email:
-                custom_inputs["user_id"] = user_email
-            
-            # Use provided session_id from app (created by AppSessionManager)
-            if session_id:
-                custom_inputs["session_id"] = session_id
-            elif user_email:
-                # Fallback only if no session_id provided
-                custom_inputs["session_id"] = f"session_{user_email}"
-            
+            inputs = self._build_chat_inputs(user_message, user_email, session_id)
+
             if self.use_direct_http:
                 # Direct HTTP call to agent endpoint
-                headers = {
-                    "Authorization": f"Bearer {self.access_token}",
-                    "Content-Type": "application/json"
-                }
-                
-                payload = {
-                    "input": [{"role": "user", "content": user_message}]
-                }
-                
-                # Add custom_inputs if present
-                if custom_inputs:
-                    payload["custom_inputs"] = custom_inputs
-                
-                print(f"[AgentClient] Making HTTP POST to {self.endpoint_url}")
-                print(f"[AgentClient] Request payload: {json.dumps(payload, indent=2)}")
+                logger.debug("Making HTTP POST to %s", self.endpoint_url)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Request payload: %s", json.dumps(inputs, indent=2))
                 
-                response = requests.post(
+                # Pre-serialized body; Content-Type comes from the session headers
+                response = self._session.post(
                     self.endpoint_url,
-                    headers=headers,
-                    json=payload,
+                    data=orjson.dumps(inputs),
                     timeout=300
                 )
                 
-                print(f"[AgentClient] Response status code: {response.status_code}")
+                logger.debug("Response status code: %s", response.status_code)
                 
                 response.raise_for_status()
                 response_data = response.json()
                 
             else:
                 # Call agent endpoint with user message using MLflow Deployments Client
-                # Agent endpoint expects "input" (array of messages), not "messages"
-                inputs = {"input": [{"role": "user", "content": user_message}]}
-                
-                # Add custom_inputs if present
-                if custom_inputs:
-                    inputs["custom_inputs"] = custom_inputs
-                
                 response_data = self.deploy_client.predict(
                     endpoint=self.agent_endpoint_name,
                     inputs=inputs,
                 )
 
-            print(f"[AgentClient] Received response from agent endpoint")
-            print(f"[AgentClient] Raw response type: {type(response_data)}")
-            print(
-                f"[AgentClient] Raw response keys: {response_data.keys() if isinstance(response_data, dict) else 'Not a dict'}"
-            )
-            if isinstance(response_data, dict):
-                print(f"[AgentClient] Response sample: {str(response_data)[:500]}")
+            return self._build_chat_result(response_data)
 
-            # Parse agent response
-            result = self._parse_agent_response(response_data)
-            print(
-                f"[AgentClient] Parsed response: {len(result.get('charts', []))} charts, table_data: {bool(result.get('table_data'))}"
-            )
+        except Exception as e:
+            error_msg = f"Error calling agent endpoint: {str(e)}"
+            logger.error(error_msg)
+            traceback.print_exc()
+            return self._error_result(error_msg)
+
+    async def chat_async(self, user_message: str, user_email: str = None, session_id: str = None) -> Dict[str, Any]:
+        """
+        Async variant of chat, suitable for running many requests concurrently
 
-            return result
+        Args:
+            user_message: User's question
+            user_email: User's email for session tracking and logging
+            session_id: App-level session ID for conversation grouping
+
+        Returns:
+            Dict with 'response', 'messages', 'charts', 'table_data', and 'error' keys
+        """
+        logger.debug("Sending message to agent endpoint (async)...")
+        logger.debug("User: %s", user_email)
+        logger.debug("Session ID: %s", session_id)
+
+        try:
+            inputs = self._build_chat_inputs(user_message, user_email, session_id)
+
+            if self.use_direct_http:
+                logger.debug("Making HTTP POST to %s", self.endpoint_url)
+
+                session = await self._get_aio_session()
+                async with session.post(self.endpoint_url, data=orjson.dumps(inputs)) as response:
+                    logger.debug("Response status code: %s", response.status)
+                    response.raise_for_status()
+                    response_data = _json_loads(await response.read())
+
+            else:
+                # MLflow Deployments client is blocking, keep it off the event loop
+                response_data = await asyncio.to_thread(
+                    self.deploy_client.predict,
+                    endpoint=self.agent_endpoint_name,
+                    inputs=inputs,
+                )
+
+            return self._build_chat_result(response_data)
 
         except Exception as e:
             error_msg = f"Error calling agent endpoint: {str(e)}"
-            print(f"[AgentClient] ERROR: {error_msg}")
-            import traceback
+            logger.error(error_msg)
+            return self._error_result(error_msg)
 
-            traceback.print_exc()
-            return {
-                "response": None,
-                "messages": [],
-                "charts": [],
-                "table_data": None,
-                "error": error_msg,
-            }
+    async def chat_batch(self, messages: list, max_concurrency: int = 8) -> list:
+        """
+        Send several messages to the agent endpoint concurrently
+
+        Args:
+            messages: List of dicts with chat_async keyword arguments
+                      (user_message, and optionally user_email / session_id)
+            max_concurrency: Maximum number of requests in flight at once
+
+        Returns:
+            List of chat result dicts in the same order as messages. Failed
+            requests carry the error in the 'error' key instead of raising.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _one(message: dict) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.chat_async(**message)
+
+        results = await asyncio.gather(*[_one(m) for m in messages], return_exceptions=True)
+        return [
+            self._error_result(f"Error calling agent endpoint: {str(r)}") if isinstance(r, BaseException) else r
+            for r in results
+        ]
+
+    def chat_batch_sync(self, messages: list, max_concurrency: int = 8) -> list:
+        """Blocking wrapper around chat_batch for scripts and CLI use"""
+        async def _run():
+            try:
+                return await self.chat_batch(messages, max_concurrency)
+            finally:
+                # The aiohttp session belongs to this event loop, which asyncio.run closes
+                await self.aclose()
+
+        return asyncio.run(_run())
 
     def _parse_agent_response(self, raw_response: dict) -> Dict[str, Any]:
         """
         Parse agent endpoint response to extract summary, charts, and table data
 
         Agent response format: {"object": "response", "output": [...], "id": "..."}
+
+        Output items are classified in a single pass, and each function call
+        output is JSON-decoded once and shared by the chart and Genie parsers.
         """
         output_array = raw_response.get("output", [])
-        print(f"[AgentClient] Parsing {len(output_array)} output items...")
+        logger.debug("Parsing %d output items...", len(output_array))
+
+        summary = ""
+        charts = []
+        table_data = None
 
-        # First, try to detect if the agent returned a JSON-encoded response
-        # This happens when the agent streams: {"content": "{\"response\": ..., \"charts\": [...], ...}"}
         for item in output_array:
-            if item.get("type") == "text" or item.get("type") == "message":
-                text_content = self._get_text_from_item(item)
-                if text_content and text_content.strip().startswith("{"):
+            item_type = item.get("type")
+
+            if item_type in _TEXT_EXTRACTORS:
+                text_content = self._get_text_from_item(item, item_type)
+                if not text_content:
+                    continue
+
+                # Detect if the agent returned a JSON-encoded response
+                # This happens when the agent streams: {"content": "{\"response\": ..., \"charts\": [...], ...}"}
+                # lstrip() only copies when there is leading whitespace, unlike strip()
+                if text_content.lstrip()[:1] == "{":
                     try:
                         # Try to parse as JSON
-                        parsed_data = json.loads(text_content)
+                        parsed_data = _json_loads(text_content)
                         if isinstance(parsed_data, dict) and "response" in parsed_data:
-                            print(f"[AgentClient] Detected JSON-encoded response format")
+                            logger.debug("Detected JSON-encoded response format")
                             return {
                                 "response": parsed_data.get("response", ""),
                                 "messages": output_array,
@@ -302,69 +736,46 @@ class AgentEndpointClient:
                     except json.JSONDecodeError:
                         pass  # Not JSON, continue with standard parsing
 
-        # Standard parsing for structured output
-        return {
-            "response": self._extract_summary(output_array),
-            "messages": output_array,
-            "charts": self._extract_charts(output_array),
-            "table_data": self._extract_genie_table(output_array),
-            "error": None,
-        }
-
-    def _extract_summary(self, output_array: list) -> str:
-        """Extract the final text summary from agent output"""
-        for item in reversed(output_array):  # Start from end - summary is usually last
-            if text := self._get_text_from_item(item):
-                print(f"[AgentClient] Found summary: {text[:100]}...")
-                return text
-
-        return "Agent processed your request"
-
-    def _get_text_from_item(self, item: dict) -> str:
-        """Extract text from various item formats"""
-        item_type = item.get("type")
-
-        # Simple text type
-        if item_type == "text":
-            return item.get("text", "")
-
-        # Message type with nested content
-        if item_type == "message":
-            content = item.get("content", "")
+                # Summary is the last text item
+                summary = text_content
 
-            # Content as string
-            if isinstance(content, str):
-                return content
+            elif item_type == "function_call_output":
+                output = item.get("output", "")
+                try:
+                    data = _json_loads(output) if isinstance(output, str) else output
+                except json.JSONDecodeError as e:
+                    logger.debug("Error parsing function output: %s", e)
+                    continue
 
-            # Content as list of objects with 'text' field
-            if isinstance(content, list) and content:
-                first_item = content[0]
-                if isinstance(first_item, dict):
-                    return first_item.get("text", "")
+                if chart := self._parse_chart_output(data):
+                    charts.append(chart)
+                    logger.debug("Found chart: %s", chart.get("chart_type", "unknown"))
 
-        return ""
+                # Only the first Genie table is used
+                if table_data is None and (table := self._parse_genie_output(data)):
+                    logger.debug("Found Genie table: %d rows", len(table["data"]))
+                    table_data = table
 
-    def _extract_charts(self, output_array: list) -> list:
-        """Extract all Plotly charts from function call outputs"""
-        charts = []
-
-        for item in output_array:
-            if item.get("type") != "function_call_output":
-                continue
+        if summary:
+            logger.debug("Found summary: %.100s...", summary)
 
-            if chart := self._parse_chart_output(item.get("output", "")):
-                charts.append(chart)
-                print(
-                    f"[AgentClient] Found chart: {chart.get('chart_type', 'unknown')}"
-                )
+        # Standard parsing for structured output
+        return {
+            "response": summary or "Agent processed your request",
+            "messages": output_array,
+            "charts": charts,
+            "table_data": table_data,
+            "error": None,
+        }
 
-        return charts
+    def _get_text_from_item(self, item: dict, item_type: str = None) -> str:
+        """Extract text from various item formats, given the item's type if already known"""
+        extractor = _TEXT_EXTRACTORS.get(item_type or item.get("type"))
+        return extractor(item) if extractor else ""
 
-    def _parse_chart_output(self, output_str: str) -> dict:
-        """Parse a single function output for chart data"""
+    def _parse_chart_output(self, data: dict) -> dict:
+        """Extract chart data from an already-decoded function output"""
         try:
-            data = json.loads(output_str) if isinstance(output_str, str) else output_str
-
             if not isinstance(data, dict):
                 return None
 
@@ -375,40 +786,28 @@ class AgentEndpointClient:
             # UC function wrapper format: {"rows": [["{...}"]], "columns": [...]}
             if "rows" in data and "columns" in data:
                 if data["rows"] and data["rows"][0]:
-                    chart_json = json.loads(data["rows"][0][0])
+                    chart_json = _json_loads(data["rows"][0][0])
                     if "plotly_json" in chart_json:
                         return chart_json
 
             return None
 
         except (json.JSONDecodeError, IndexError, KeyError, TypeError) as e:
-            print(f"[AgentClient] Error parsing chart: {e}")
+            logger.warning("Error parsing chart: %s", e)
             return None
 
-    def _extract_genie_table(self, output_array: list) -> dict:
-        """Extract table data from Genie function call outputs"""
-        for item in output_array:
-            if item.get("type") != "function_call_output":
-                continue
-
-            if table := self._parse_genie_output(item.get("output", "")):
-                print(f"[AgentClient] Found Genie table: {len(table['data'])} rows")
-                return table
-
-        return None
-
-    def _parse_genie_output(self, output_str: str) -> dict:
-        """Parse Genie's complex response into simple table format"""
+    def _parse_genie_output(self, data: dict) -> dict:
+        """Parse Genie's complex response from an already-decoded function output into simple table format"""
         try:
-            # Parse outer JSON
-            data = json.loads(output_str) if isinstance(output_str, str) else output_str
-
             if not isinstance(data, dict) or "content" not in data:
                 return None
 
             # Parse nested content
             content = data["content"]
-            content_data = json.loads(content) if isinstance(content, str) else content
+            if isinstance(content, str) and len(content) > _GENIE_STREAM_THRESHOLD:
+                return self._stream_genie_table(content)
+
+            content_data = _json_loads(content) if isinstance(content, str) else content
 
             # Check for Genie statement_response
             if "statement_response" not in content_data:
@@ -417,10 +816,38 @@ class AgentEndpointClient:
             # Transform complex format to simple format
             return self._transform_genie_response(content_data)
 
-        except (json.JSONDecodeError, KeyError, TypeError) as e:
-            print(f"[AgentClient] Error parsing Genie output: {e}")
+        except (json.JSONDecodeError, ijson.JSONError, KeyError, TypeError) as e:
+            logger.warning("Error parsing Genie output: %s", e)
+            return None
+
+    def _stream_genie_table(self, content: str) -> dict:
+        """
+        Build the simple table format from a large Genie response without
+        materializing the whole parsed JSON tree; rows are decoded one at a
+        time and reading stops at max_table_rows
+        """
+        raw = content.encode("utf-8")
+
+        # Walk parse events rather than ijson.items so the scan stops at the end of
+        # the columns array instead of reading on through the rest of the document
+        columns = []
+        for prefix, event, value in ijson.parse(raw):
+            if prefix == "statement_response.manifest.schema.columns.item.name" and event == "string":
+                columns.append(value)
+            elif prefix == "statement_response.manifest.schema.columns" and event == "end_array":
+                break
+        if not columns:
             return None
 
+        rows = ijson.items(raw, "statement_response.result.data_array.item")
+        if self.max_table_rows is not None:
+            rows = islice(rows, self.max_table_rows)
+
+        data = [list(map(_get_string_value, row["values"])) for row in rows]
+        logger.debug("Stream-parsed Genie table: %d rows", len(data))
+
+        return {"data": data, "columns": columns}
+
     def _transform_genie_response(self, genie_response: dict) -> dict:
         """
         Transform Genie's nested response to simple table format
@@ -436,14 +863,15 @@ class AgentEndpointClient:
             # Extract columns
             columns = [col["name"] for col in schema["columns"]]
 
-            # Extract data rows
-            data = [
-                [val["string_value"] for val in row["values"]]
-                for row in result["data_array"]
-            ]
+            data_array = result["data_array"]
+            if self.max_table_rows is not None:
+                data_array = data_array[:self.max_table_rows]
+
+            # Extract data rows (Genie returns every cell as a string_value)
+            data = [list(map(_get_string_value, row["values"])) for row in data_array]
 
             return {"data": data, "columns": columns}
 
         except (KeyError, TypeError) as e:
-            print(f"[AgentClient] Error transforming Genie response: {e}")
+            logger.warning("Error transforming Genie response: %s", e)
             return None
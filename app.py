@@ -1,22 +1,42 @@
 import sys
 import os
-import json
+import datetime
+import base64
+import re
 import time
-import requests
+import uuid
+import asyncio
+import logging
+import diskcache
+import httpx
 import streamlit as st
 import pandas as pd
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import plotly.io as pio
-import plotly.graph_objects as go
+from collections import defaultdict, deque
 import numpy as np
+import orjson
 from dotenv import load_dotenv
-from databricks.sdk import WorkspaceClient
 from agent_endpoint_client import AgentEndpointClient
 
 # Load environment variables
 load_dotenv()
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+# Line traces longer than this are downsampled with LTTB before rendering
+MAX_TRACE_POINTS = 2000
+# Scatter traces longer than this are rendered with WebGL (scattergl) instead of SVG
+WEBGL_MIN_POINTS = 1000
+_DECIMAL_CHECK_BLOCK = 4096
+# Date strings (ISO or US style) that x values must start with to be parsed as dates
+_DATE_PREFIX = re.compile(r"\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{2,4}")
+# Genie table rows kept per response (and stored in the session); longer tables are cut off
+MAX_TABLE_ROWS = 5000
+# Chat messages kept in the session; older ones are dropped as new ones arrive
+MAX_HISTORY_MESSAGES = 200
+# Minimum seconds between trace panel redraws while streaming
+TRACE_FLUSH_INTERVAL = 0.05
+
 # App Session Manager Class
 class AppSessionManager:
     """Manages app-level session lifecycle"""
@@ -24,9 +44,310 @@ class AppSessionManager:
     def __init__(self, user_email: str):
         self.user_email = user_email
         self.session_id = f"session_{user_email}"
-        print(f"[SESSION] Session ID: {self.session_id}")
+        logger.info("[SESSION] Session ID: %s", self.session_id)
+
+
+# Crunchyroll theme, registered once as the default Plotly template (see _plotly_io)
+CR_THEME_LAYOUT = {
+    # Streamlit's dark-theme chart palette, which the charts used before the
+    # theme moved into this template
+    "colorway": [
+        "#83c9ff", "#0068c9", "#ffabab", "#ff2b2b", "#7defa1",
+        "#29b09d", "#ffd16a", "#ff8700", "#6d3fc0", "#d5dae5",
+    ],
+    "plot_bgcolor": "#1a1a1a",
+    "paper_bgcolor": "#1a1a1a",
+    "font": {"color": "#ffffff", "size": 14, "family": "Lato, sans-serif"},
+    "title": {
+        "font": {"color": "#F47521", "size": 18, "family": "Lato, sans-serif", "weight": "bold"},
+    },
+    "xaxis": {
+        "gridcolor": "#333333",
+        "zerolinecolor": "#F47521",
+        "color": "#ffffff",
+        "title": {"font": {"size": 14, "color": "#F47521", "weight": "bold"}},
+        "tickfont": {"size": 12, "color": "#ffffff"},
+    },
+    "yaxis": {
+        "gridcolor": "#333333",
+        "zerolinecolor": "#F47521",
+        "color": "#ffffff",
+        "title": {"font": {"size": 14, "color": "#F47521", "weight": "bold"}},
+        "tickfont": {"size": 12, "color": "#ffffff"},
+    },
+}
+
+
+# Minimal Plotly config for every chart: no logo, tips, MathJax typesetting
+# or selection tools we don't use
+PLOTLY_CONFIG = {
+    "responsive": True,
+    "displaylogo": False,
+    "showTips": False,
+    "typesetMath": False,
+    "modeBarButtonsToRemove": ["lasso2d", "select2d", "autoScale2d", "toggleSpikelines"],
+}
+
+
+def _plotly_io():
+    """
+    Import plotly.io on first use so a cold start doesn't pay for it before
+    the first chart, serialize figures with orjson (much faster than stdlib json)
+    and make the Crunchyroll theme the default template
+    """
+    import plotly.io as pio
+    pio.json.config.default_engine = "orjson"
+    if "crunchyroll" not in pio.templates:
+        import plotly.graph_objects as go
+        pio.templates["crunchyroll"] = go.layout.Template(layout=CR_THEME_LAYOUT)
+        pio.templates.default = "crunchyroll"
+    return pio
+
+
+def _figure_from_payload(plotly_json):
+    """
+    Build a figure from an agent chart payload without a dumps/loads round trip
+
+    Args:
+        plotly_json: Figure dict, or a JSON string of one
+
+    Returns:
+        go.Figure built without property validation. The payload comes from our
+        own agent and has already been formatted, and Plotly.js ignores any
+        property it doesn't know (e.g. from a newer Plotly version)
+    """
+    # Also switches the serialization Streamlit does on the figure to orjson
+    _plotly_io()
+    if not isinstance(plotly_json, dict):
+        plotly_json = orjson.loads(plotly_json)
+    import plotly.graph_objects as go
+    # _validate is a private Figure argument (no public equivalent); it also makes
+    # skip_invalid a no-op, so unknown properties pass straight through to Plotly.js
+    return go.Figure(plotly_json, _validate=False)
+
+
+def _deep_merge(base: dict, overrides: dict) -> dict:
+    """
+    Recursively merge overrides into a copy of base, the dict equivalent of
+    fig.update_layout: nested dicts are merged, other values replaced
+    """
+    merged = dict(base)
+    for key, value in overrides.items():
+        current = merged.get(key)
+        if key == "title" and isinstance(current, str):
+            # Plotly accepts a bare string as shorthand for {"text": ...}
+            current = {"text": current}
+        if isinstance(value, dict) and isinstance(current, dict):
+            merged[key] = _deep_merge(current, value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _update_axes(layout: dict, axis: str, **props):
+    """Dict equivalent of fig.update_xaxes / fig.update_yaxes: update every axis of that kind"""
+    keys = [key for key in layout if key == axis or (key.startswith(axis) and key[len(axis):].isdigit())]
+    for key in keys or [axis]:
+        layout[key] = _deep_merge(layout.get(key) or {}, props)
+
+
+def _axis_title(layout: dict, axis: str):
+    """Return an axis title's text, whether the title is stored as a string or a dict"""
+    title = (layout.get(axis) or {}).get("title")
+    if isinstance(title, dict):
+        return title.get("text")
+    return title
+
+
+def _decode_typed_arrays(data: list):
+    """
+    Turn top-level trace arrays that Plotly serialized as base64 typed arrays
+    ({"dtype": ..., "bdata": ...}) back into numpy arrays so they can be processed
+    """
+    for trace in data:
+        for key, value in trace.items():
+            if isinstance(value, dict) and "bdata" in value and "dtype" in value:
+                arr = np.frombuffer(base64.b64decode(value["bdata"]), dtype=value["dtype"])
+                if value.get("shape"):
+                    arr = arr.reshape([int(dim) for dim in str(value["shape"]).split(",")])
+                trace[key] = arr
+
+
+def _downsample_trace(trace: dict, y_arr: np.ndarray):
+    """
+    Reduce a long line trace to MAX_TRACE_POINTS using LTTB, which keeps the
+    visual shape of the series while shrinking what Plotly has to serialize.
+    Traces LTTB can't represent faithfully (marker plots, per-point marker
+    styling, unsorted or non-numeric x) are left as they are.
+    """
+    if np.isnan(y_arr).any():
+        # LTTB needs a gap-free numeric series
+        return
+
+    # Plotly draws long scatter traces without an explicit mode as lines
+    mode = trace.get("mode") or "lines"
+    if "lines" not in mode or "markers" in mode:
+        return
+    marker = trace.get("marker") or {}
+    if any(
+        not isinstance(value, (str, dict)) and np.ndim(value) == 1 and len(value) == len(y_arr)
+        for value in marker.values()
+    ):
+        return
+
+    from tsdownsample import LTTBDownsampler
+
+    if trace.get("x") is None:
+        idx = LTTBDownsampler().downsample(y_arr, n_out=MAX_TRACE_POINTS)
+    else:
+        x_arr = np.asarray(trace["x"])
+        if np.issubdtype(x_arr.dtype, np.datetime64):
+            x_num = x_arr.astype("datetime64[ns]").view(np.int64)
+        elif np.issubdtype(x_arr.dtype, np.number):
+            x_num = x_arr.astype(np.float64)
+        else:
+            # Category x (or mixed values) has no numeric spacing to weigh points by
+            return
+        if len(x_num) != len(y_arr) or not np.isfinite(x_num).all() or np.any(np.diff(x_num) < 0):
+            # LTTB buckets points along x, so x has to be gap-free and sorted
+            return
+        idx = LTTBDownsampler().downsample(x_num, y_arr, n_out=MAX_TRACE_POINTS)
+
+    # Keep per-point arrays aligned with the selected points
+    for attr in ("text", "hovertext", "customdata"):
+        values = trace.get(attr)
+        if values is not None and not isinstance(values, str) and len(values) == len(y_arr):
+            trace[attr] = np.asarray(values)[idx]
+
+    # Without explicit x, Plotly uses the point index, so pin the original positions
+    trace["x"] = np.asarray(trace["x"])[idx] if trace.get("x") is not None else idx
+    trace["y"] = y_arr[idx]
+
+
+def _to_dt_cached(s: pd.Series):
+    """
+    Parse date strings once per unique value and map the results back onto the series
+
+    Returns:
+        Parsed series, or None unless every value is a full date (values like
+        "10:30" or "2024-Q1" would otherwise be mis-parsed or fail halfway)
+    """
+    uniques = pd.unique(s)
+    if not all(isinstance(value, str) and _DATE_PREFIX.match(value) for value in uniques):
+        return None
+    parsed = pd.to_datetime(uniques, errors="coerce", format="mixed")
+    if pd.isna(parsed).any():
+        return None
+    return s.map(dict(zip(uniques, parsed)))
+
+
+def _use_webgl(data: list):
+    """
+    Switch long scatter traces to scattergl so the browser draws them on the GPU.
+    Stacked traces stay SVG since scattergl has no stackgroup support; other
+    scatter-only properties are passed through and ignored by Plotly.js.
+    """
+    for trace in data:
+        if (
+            trace.get("type", "scatter") == "scatter"
+            and trace.get("y") is not None
+            and len(trace["y"]) > WEBGL_MIN_POINTS
+            and trace.get("stackgroup") is None
+        ):
+            trace["type"] = "scattergl"
+
+
+def _has_decimals(values) -> bool:
+    """
+    Check whether any finite value has a fractional part. Long arrays are
+    scanned in blocks so the check stops at the first block with a decimal.
+    """
+    arr = np.asarray(values, dtype=np.float64)
+    for start in range(0, max(arr.size, 1), _DECIMAL_CHECK_BLOCK):
+        block = arr[start:start + _DECIMAL_CHECK_BLOCK]
+        block = block[np.isfinite(block)]
+        if np.any(block != np.floor(block)):
+            return True
+    return False
+
 
 def fix_chart_formatting(fig):
+    """
+    Fix common chart formatting issues (see _apply_chart_formatting).
+
+    Results are cached by the figure's JSON, so Streamlit reruns with an
+    unchanged chart skip the formatting pass entirely.
+
+    Args:
+        fig: Figure dict, or a JSON string of one
+
+    Returns:
+        Formatted figure dict, or None if the chart shouldn't be shown
+    """
+    if isinstance(fig, str):
+        fig_json = fig.encode()
+    else:
+        fig_json = orjson.dumps(fig, option=orjson.OPT_SERIALIZE_NUMPY)
+    return _fix_chart_formatting_cached(fig_json)
+
+
+def _strip_theme_props(layout: dict, theme: dict):
+    """
+    Remove the layout properties a theme sets (applied to every numbered axis
+    for the axis entries), since explicit layout values take precedence over
+    the template
+    """
+    for key, theme_value in theme.items():
+        if key in ("xaxis", "yaxis"):
+            targets = [name for name in layout if name == key or (name.startswith(key) and name[len(key):].isdigit())]
+        else:
+            targets = [key]
+        for name in targets:
+            if not isinstance(theme_value, dict):
+                layout.pop(name, None)
+            elif isinstance(layout.get(name), dict):
+                _strip_theme_props(layout[name], theme_value)
+
+
+def _themed_chart(chart_cache: dict, msg_id: str, chart_idx: int, chart_info: dict):
+    """
+    Formatted figure dict for one of a message's charts, set up to pick up the
+    default Crunchyroll template.
+    Built once per (msg_id, chart_idx) and reused on later reruns; the result is
+    also written back into chart_info (flagged "_cr_fixed"), so a message never
+    goes through formatting twice even if the cache entry is dropped.
+
+    Returns:
+        Figure dict, or None if the chart shouldn't be shown
+    """
+    cache_key = (msg_id, chart_idx)
+    if cache_key not in chart_cache:
+        fig_dict = chart_info.get("plotly_json")
+        if not chart_info.get("_cr_fixed"):
+            # Fix chart formatting issues on the raw figure dict
+            fig_dict = fix_chart_formatting(fig_dict)
+            if fig_dict is not None:
+                # Drop the payload's own template, and any explicit layout values the
+                # theme sets, so the default Crunchyroll template applies in full. A
+                # payload's own colorway is kept; it took precedence before as well
+                layout = fig_dict.get("layout") or {}
+                layout.pop("template", None)
+                _strip_theme_props(
+                    layout, {key: value for key, value in CR_THEME_LAYOUT.items() if key != "colorway"}
+                )
+            chart_info["plotly_json"] = fig_dict
+            chart_info["_cr_fixed"] = True
+        chart_cache[cache_key] = fig_dict
+    return chart_cache[cache_key]
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _fix_chart_formatting_cached(fig_json: bytes):
+    """Apply chart formatting fixes to a serialized figure and return the figure dict (or None)"""
+    return _apply_chart_formatting(orjson.loads(fig_json))
+
+
+def _apply_chart_formatting(fig: dict):
     """
     Fix common chart formatting issues:
     1. Remove scientific notation from axes
@@ -36,14 +357,20 @@ def fix_chart_formatting(fig):
     """
     try:
         # Get figure data
-        if not fig.data:
+        data = fig.get("data") or []
+        if not data:
             return fig
+        layout = fig.get("layout") or {}
+        fig["layout"] = layout
+
+        _decode_typed_arrays(data)
         
         # Check if x-axis contains dates
         has_date_x = False
-        if fig.data and hasattr(fig.data[0], 'x') and fig.data[0].x is not None:
+        first_x = data[0].get("x")
+        if first_x is not None:
             # Check if x values look like dates
-            x_sample = fig.data[0].x[0] if len(fig.data[0].x) > 0 else None
+            x_sample = first_x[0] if len(first_x) > 0 else None
             if x_sample:
                 # If it's a string that contains date-like patterns, or already a datetime
                 has_date_x = (
@@ -53,21 +380,37 @@ def fix_chart_formatting(fig):
                 )
         
         # Process each trace
-        for trace in fig.data:
-            # Convert y values to numeric if they're strings
-            if hasattr(trace, 'y') and trace.y is not None:
-                y_values = [float(v) if isinstance(v, str) else v for v in trace.y]
-                trace.y = y_values
+        for trace in data:
+            trace_type = trace.get("type", "scatter")
+            x = trace.get("x")
+
+            # Parse date-string x values up front (Genie output repeats the same dates a lot)
+            if has_date_x and x is not None and len(x) and isinstance(x[0], str):
+                parsed_x = _to_dt_cached(pd.Series(x))
+                if parsed_x is not None:
+                    trace["x"] = np.asarray(parsed_x)
+
+            # Convert y values (including numeric strings) to a float array in one pass;
+            # missing values become NaN
+            if trace.get("y") is not None:
+                y_arr = np.asarray(trace["y"], dtype=np.float64)
+                trace["y"] = y_arr
+
+                # Downsample long line traces before the padding and hover logic
+                if trace_type in ("scatter", "scattergl") and y_arr.size > MAX_TRACE_POINTS:
+                    _downsample_trace(trace, y_arr)
+                    y_arr = trace["y"]
                 
                 # Check if this is a single data point chart
-                if len(y_values) == 1:
+                if y_arr.size == 1:
                     # Don't show chart for single data point
                     return None
                 
                 # Calculate range with 5% padding
-                if y_values:
-                    y_min = min(y_values)
-                    y_max = max(y_values)
+                finite_y = y_arr[np.isfinite(y_arr)]
+                if finite_y.size:
+                    y_min = float(finite_y.min())
+                    y_max = float(finite_y.max())
                     y_range = y_max - y_min
                     
                     # Add 5% padding on each side
@@ -81,45 +424,53 @@ def fix_chart_formatting(fig):
                         range_max = y_max * 1.05 if y_max > 0 else y_max + abs(y_max) * 0.05
                     
                     # Update y-axis range
-                    fig.update_yaxes(range=[range_min, range_max])
+                    _update_axes(layout, "yaxis", range=[range_min, range_max])
             
             # For pie charts, check if there's only one value
-            if trace.type == 'pie' and hasattr(trace, 'values') and trace.values is not None:
-                if len(trace.values) == 1:
+            if trace_type == 'pie' and trace.get("values") is not None:
+                if len(trace["values"]) == 1:
                     # Don't show pie chart for single value
                     return None
             
             # For bar charts, sort by value (descending) - but only if x-axis is not dates
-            if trace.type == 'bar' and not has_date_x and hasattr(trace, 'y') and hasattr(trace, 'x'):
+            if trace_type == 'bar' and not has_date_x and "y" in trace and "x" in trace:
                 try:
-                    # Create pairs of (x, y) and sort by y descending
-                    pairs = list(zip(trace.x, trace.y))
-                    pairs_sorted = sorted(pairs, key=lambda p: float(p[1]) if p[1] is not None else 0, reverse=True)
-                    
-                    if pairs_sorted:
-                        trace.x, trace.y = zip(*pairs_sorted)
+                    # Sort by y descending in a single C-level pass; missing values go last
+                    y_arr = np.asarray(trace["y"], dtype=np.float64)
+                    order = np.argsort(-np.nan_to_num(y_arr, nan=-np.inf), kind="stable")
+                    trace["x"] = np.asarray(trace["x"])[order]
+                    trace["y"] = y_arr[order]
                 except Exception:
                     pass  # Keep original order if sorting fails
         
+        # Swap long scatter traces to WebGL rendering
+        _use_webgl(data)
+        
         # Disable scientific notation on axes, but only format as numbers if not dates
         if has_date_x:
             # Don't apply numeric formatting to x-axis if it contains dates
-            fig.update_xaxes(exponentformat='none')
+            _update_axes(layout, "xaxis", exponentformat='none')
         else:
             # Apply numeric formatting to x-axis
-            fig.update_xaxes(
+            _update_axes(
+                layout,
+                "xaxis",
                 tickformat=',.0f',  # Format with comma separators, no decimals
                 exponentformat='none'  # Disable scientific notation
             )
         
         # Always apply numeric formatting to y-axis (values)
-        fig.update_yaxes(
+        _update_axes(
+            layout,
+            "yaxis",
             tickformat=',.0f',  # Format with comma separators, no decimals
             exponentformat='none'  # Disable scientific notation
         )
         
         # Add vertical spike line on hover only
-        fig.update_xaxes(
+        _update_axes(
+            layout,
+            "xaxis",
             showspikes=True, 
             spikemode='across', 
             spikesnap='cursor', 
@@ -129,47 +480,88 @@ def fix_chart_formatting(fig):
             showgrid=True,
             gridcolor='rgba(128, 128, 128, 0.2)'
         )
-        fig.update_yaxes(
+        _update_axes(
+            layout,
+            "yaxis",
             showspikes=False,
             showgrid=True,
             gridcolor='rgba(128, 128, 128, 0.2)'
         )
         
         # Set hover mode to show closest data point and position label above point
-        fig.update_layout(
-            hovermode='x unified',
-            hoverlabel=dict(
-                bgcolor='rgba(26, 26, 26, 0.9)',
-                font_size=12,
-                font_color='white'
-            )
-        )
+        fig["layout"] = layout = _deep_merge(layout, {
+            "hovermode": 'x unified',
+            "hoverlabel": {
+                "bgcolor": 'rgba(26, 26, 26, 0.9)',
+                "font": {"size": 12, "color": 'white'},
+            },
+        })
         
         # Update hover template to show actual values with proper formatting
-        for trace in fig.data:
-            if hasattr(trace, 'y') and trace.y is not None:
-                # Get the y-axis title from the layout
-                y_label = 'value'
-                if hasattr(fig.layout, 'yaxis') and hasattr(fig.layout.yaxis, 'title') and fig.layout.yaxis.title:
-                    if hasattr(fig.layout.yaxis.title, 'text') and fig.layout.yaxis.title.text:
-                        y_label = fig.layout.yaxis.title.text
-                
+        # Get the y-axis title from the layout
+        y_label = _axis_title(layout, "yaxis") or 'value'
+        for trace in data:
+            if trace.get("y") is not None:
                 # Check if values have decimals
-                has_decimals = any(isinstance(v, float) and v != int(v) for v in trace.y if v is not None)
+                has_decimals = _has_decimals(trace["y"])
                 
                 if has_decimals:
                     # Show 2 decimal places for values with decimals
-                    trace.update(hovertemplate=y_label + ': %{y:.2f}<extra></extra>')
+                    trace["hovertemplate"] = y_label + ': %{y:.2f}<extra></extra>'
                 else:
                     # Show integers with comma separators
-                    trace.update(hovertemplate=y_label + ': %{y:,.0f}<extra></extra>')
+                    trace["hovertemplate"] = y_label + ': %{y:,.0f}<extra></extra>'
         
         return fig
         
     except Exception as e:
-        print(f"Error fixing chart formatting: {e}")
+        logger.warning("Error fixing chart formatting: %s", e)
         return fig  # Return original if fixing fails
 
+def _downcast_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shrink column dtypes before handing a table to st.dataframe:
+    - ints to the smallest (unsigned when non-negative) int type
+    - floats to float32
+    - low-cardinality text columns to category
+    """
+    if df.empty:
+        return df
+    for col in df.select_dtypes("integer"):
+        downcast = "unsigned" if (df[col] >= 0).all() else "signed"
+        df[col] = pd.to_numeric(df[col], downcast=downcast)
+    for col in df.select_dtypes("float"):
+        df[col] = pd.to_numeric(df[col], downcast="float")
+    for col in df.select_dtypes("object"):
+        if df[col].nunique() / len(df) < 0.5:
+            df[col] = df[col].astype("category")
+    return df
+
+
+@st.cache_data(show_spinner=False)
+def _display_name(email: str) -> str:
+    """Derive display name from email: "abc.fds@some.com" → "Abc Fds" """
+    try:
+        local_part = email.split("@")[0]
+        return " ".join(part.capitalize() for part in local_part.replace(".", " ").replace("_", " ").split())
+    except Exception:
+        return "there"
+
+
+def _table_frame(chart_cache: dict, msg_id: str, table_data: dict) -> pd.DataFrame:
+    """
+    Downcast DataFrame for a message's table, built once per msg_id with
+    DataFrame.from_records and reused on later reruns
+    """
+    cache_key = (msg_id, "table")
+    if cache_key not in chart_cache:
+        df = pd.DataFrame.from_records(
+            table_data.get("data", []), columns=table_data.get("columns", [])
+        )
+        chart_cache[cache_key] = _downcast_dataframe(df)
+    return chart_cache[cache_key]
+
+
 # Get user information from Databricks App headers
 def get_user_email():
     """Get user email from Databricks App context"""
@@ -187,7 +579,7 @@ def get_user_email():
         # If running locally/not in Databricks App, fallback to anonymous
         return "anonymous@local.dev"
     except Exception as e:
-        print(f"Error getting user email: {e}")
+        logger.warning("Error getting user email: %s", e)
         return "anonymous@local.dev"
 
 def get_user_token():
@@ -202,7 +594,7 @@ def get_user_token():
         headers = st.context.headers
         
         # Log all available headers for debugging
-        print(f"Available headers: {list(headers.keys())}")
+        logger.debug("Available headers: %s", headers.keys())
         
         # Try multiple possible token header names
         user_token = (
@@ -211,17 +603,20 @@ def get_user_token():
             headers.get("Authorization") or
             headers.get("authorization")
         )
-        print(f"token {user_token}")
         return user_token
     except Exception as e:
-        print(f"Error getting user token: {e}")
+        logger.warning("Error getting user token: %s", e)
         return None
 
-# Get user email for session tracking
-user_email = get_user_email()
-user_token = get_user_token()
-print(f"App user: {user_email}")
-print(f"User token: {user_token[:20] + '...' if user_token else 'None'}")
+# Get user email for session tracking. Request headers are fixed for the lifetime
+# of a browser session, so resolve them once and reuse them on every rerun
+if "user_email" not in st.session_state:
+    st.session_state.user_email = get_user_email()
+    st.session_state.user_token = get_user_token()
+    logger.info("App user: %s", st.session_state.user_email)
+    logger.debug("User token: %s", "present" if st.session_state.user_token else "None")
+user_email = st.session_state.user_email
+user_token = st.session_state.user_token
 
 # Get agent endpoint configuration from environment
 AGENT_ENDPOINT_NAME = os.getenv("AGENT_ENDPOINT_NAME", "")
@@ -231,40 +626,58 @@ DATABRICKS_TOKEN = os.getenv("DATABRICKS_TOKEN", "<YOUR_DATABRICKS_SERVICE_PRINC
 ENV = os.getenv("ENV", "prod")
 ENV =  "dev"
 
+
+# Agent clients cached at once (one per user token), and how long each is kept;
+# tokens rotate, so old entries are evicted and their connection pools closed
+AGENT_CLIENT_CACHE_ENTRIES = 32
+AGENT_CLIENT_CACHE_TTL = 3600
+
+
+@st.cache_resource(
+    show_spinner=False,
+    max_entries=AGENT_CLIENT_CACHE_ENTRIES,
+    ttl=AGENT_CLIENT_CACHE_TTL,
+    on_release=AgentEndpointClient.close,
+)
+def _get_agent_client(endpoint_url: str, access_token: str) -> AgentEndpointClient:
+    """One direct-HTTP client (and its keep-alive pool) per user token, reused across reruns"""
+    return AgentEndpointClient(
+        endpoint_url=endpoint_url,
+        access_token=access_token,
+        max_table_rows=MAX_TABLE_ROWS,
+    )
+
+
 # Initialize agent endpoint client
 try:
     # Check if we should use direct HTTP access or MLflow Deployments
-    some_token = get_user_token()
-    print(f"Retrieved user token for agent client initialization: {some_token[:20] + '...' if some_token else 'Not found'}")
+    some_token = user_token
     if AGENT_ENDPOINT_URL and DATABRICKS_TOKEN:
         # Use direct HTTP access
-        agent = AgentEndpointClient(
-            endpoint_url=AGENT_ENDPOINT_URL,
-            access_token=some_token
-        )
+        agent = _get_agent_client(AGENT_ENDPOINT_URL, some_token)
         client_initialized = True
-        print(f"✅ Connected to agent endpoint via direct HTTP: {AGENT_ENDPOINT_URL}")
+        logger.info("✅ Connected to agent endpoint via direct HTTP: %s", AGENT_ENDPOINT_URL)
     else:
         # Fall back to MLflow Deployments
+        from databricks.sdk import WorkspaceClient
+
         workspace_client = WorkspaceClient()
         agent = AgentEndpointClient(
             agent_endpoint_name=AGENT_ENDPOINT_NAME, 
-            workspace_client=workspace_client
+            workspace_client=workspace_client,
+            max_table_rows=MAX_TABLE_ROWS,
         )
         client_initialized = True
-        print(f"✅ Connected to agent endpoint via MLflow: {AGENT_ENDPOINT_NAME}")
+        logger.info("✅ Connected to agent endpoint via MLflow: %s", AGENT_ENDPOINT_NAME)
 
 except Exception as e:
-    print(f"❌ Error initializing agent client: {e}")
-    import traceback
-
-    traceback.print_exc()
+    logger.exception("❌ Error initializing agent client: %s", e)
     client_initialized = False
     agent = None
 
 # Initialize session manager
 session_manager = AppSessionManager(user_email)
-print(f"✅ Session initialized: {session_manager.session_id}")
+logger.info("✅ Session initialized: %s", session_manager.session_id)
 
 # -------------------------
 # Genie Space Configuration
@@ -280,12 +693,21 @@ GENIE_SPACES = {
 }
 
 
+@st.cache_resource
+def _get_past_chats_cache() -> diskcache.Cache:
+    """On-disk cache of past chat messages, shared across sessions and restarts"""
+    return diskcache.Cache(os.path.expanduser("~/.cache/cdi-agent"))
+
+
 @st.cache_data(ttl=300, show_spinner=False)
-def fetch_past_chats(token: str, spaces: dict) -> list:
+def fetch_past_chats(token: str, spaces: dict, user_email: str = "") -> dict:
     """
-    Fetch past user queries from all Genie spaces in parallel:
-    - All spaces fetched concurrently
-    - All conversations within each space fetched concurrently
+    Fetch past user queries from all Genie spaces concurrently:
+    - Conversation listings for all spaces gathered in one batch
+    - Only conversations that are new or updated since the last fetch have
+      their messages re-fetched; the rest come from the on-disk cache
+    - Requests multiplexed over shared HTTP/2 connections
+    - Returned pre-grouped by time label and space (see _group_past_chats)
     """
     effective_token = token or LOCAL_DEV_PAT
     headers = {
@@ -293,16 +715,16 @@ def fetch_past_chats(token: str, spaces: dict) -> list:
         "Content-Type": "application/json",
     }
     base_url = DATABRICKS_INSTANCE.rstrip("/")
-    results = []
+    disk_cache = _get_past_chats_cache()
 
-    def fetch_messages_for_conv(space_name, space_id, conv_id):
-        """Fetch messages for a single conversation."""
+    async def fetch_messages_for_conv(client, space_name, space_id, conv_id):
+        """Fetch messages for a single conversation, or None on failure."""
         try:
             msg_url = f"{base_url}/api/2.0/genie/spaces/{space_id}/conversations/{conv_id}/messages"
-            msg_resp = requests.get(msg_url, headers=headers, params={"page_size": 50}, timeout=8)
+            msg_resp = await client.get(msg_url, params={"page_size": 50})
             msg_resp.raise_for_status()
             items = []
-            for msg in msg_resp.json().get("messages", []):
+            for msg in orjson.loads(msg_resp.content).get("messages", []):
                 content = msg.get("content", "")
                 if content:
                     items.append({
@@ -312,66 +734,132 @@ def fetch_past_chats(token: str, spaces: dict) -> list:
                     })
             return items
         except Exception as e:
-            print(f"[PAST CHATS] Error fetching messages for conv {conv_id}: {e}")
-            return []
+            logger.warning("[PAST CHATS] Error fetching messages for conv %s: %s", conv_id, e)
+            return None
 
-    def fetch_space(space_name, space_id):
-        """Fetch all conversations + their messages for a single space."""
-        space_results = []
+    async def fetch_space(client, space_name, space_id):
+        """Fetch a space's conversations, re-fetching messages only for changed ones."""
+        cache_key = ("convs", user_email, space_id)
+        # {conv_id: {"ts": last_updated_timestamp, "items": [...]}}
+        cached = disk_cache.get(cache_key) or {}
         try:
             conv_url = f"{base_url}/api/2.0/genie/spaces/{space_id}/conversations"
-            conv_resp = requests.get(conv_url, headers=headers, params={"page_size": 20}, timeout=8)
+            conv_resp = await client.get(conv_url, params={"page_size": 20})
             conv_resp.raise_for_status()
-            conversations = conv_resp.json().get("conversations", [])
-            print(f"[PAST CHATS] Space '{space_name}': {len(conversations)} conversations")
-            # Fetch all conversations in parallel
-            with ThreadPoolExecutor(max_workers=5) as msg_ex:
-                futures = [
-                    msg_ex.submit(
-                        fetch_messages_for_conv,
-                        space_name,
-                        space_id,
-                        conv.get("conversation_id") or conv.get("id"),
-                    )
-                    for conv in conversations
-                    if conv.get("conversation_id") or conv.get("id")
-                ]
-                for f in as_completed(futures):
-                    space_results.extend(f.result())
+            conversations = orjson.loads(conv_resp.content).get("conversations", [])
         except Exception as e:
-            print(f"[PAST CHATS] Error listing conversations for space '{space_name}': {e}")
-        return space_results
-
-    # Fetch all spaces in parallel
-    with ThreadPoolExecutor(max_workers=len(spaces) or 1) as space_ex:
-        futures = [
-            space_ex.submit(fetch_space, space_name, space_id)
-            for space_name, space_id in spaces.items()
-            if space_id
+            logger.warning("[PAST CHATS] Error listing conversations for space '%s': %s", space_name, e)
+            return [item for conv in cached.values() for item in conv["items"]]
+
+        listed = {}
+        for conv in conversations:
+            conv_id = conv.get("conversation_id") or conv.get("id")
+            if conv_id:
+                listed[conv_id] = (
+                    conv.get("last_updated_timestamp") or conv.get("created_timestamp") or 0
+                )
+        # Each conversation carries its own watermark, so a failed fetch stays
+        # stale and is retried on the next run instead of being masked by newer ones
+        stale = [
+            conv_id for conv_id, updated in listed.items()
+            if conv_id not in cached or updated > cached[conv_id]["ts"]
         ]
-        for f in as_completed(futures):
-            results.extend(f.result())
+        logger.info(
+            "[PAST CHATS] Space '%s': %d conversations, %d to refresh",
+            space_name, len(conversations), len(stale),
+        )
+
+        fetched = await asyncio.gather(
+            *(fetch_messages_for_conv(client, space_name, space_id, conv_id) for conv_id in stale)
+        )
+        # Keep only conversations still in the listing; failed fetches keep their cached items
+        convs = {conv_id: cached[conv_id] for conv_id in listed if conv_id in cached}
+        convs.update(
+            (conv_id, {"ts": listed[conv_id], "items": items})
+            for conv_id, items in zip(stale, fetched)
+            if items is not None
+        )
+        disk_cache.set(cache_key, convs)
+        return [item for conv in convs.values() for item in conv["items"]]
 
+    async def fetch_all():
+        async with httpx.AsyncClient(
+            http2=True,
+            headers=headers,
+            timeout=8,
+            limits=httpx.Limits(max_connections=64),
+        ) as client:
+            batches = await asyncio.gather(*(
+                fetch_space(client, space_name, space_id)
+                for space_name, space_id in spaces.items()
+                if space_id
+            ))
+        return [item for batch in batches for item in batch]
+
+    results = asyncio.run(fetch_all())
     results.sort(key=lambda x: x["timestamp_ms"], reverse=True)
-    return results
-
-
-def _format_chat_timestamp(ts_ms: int) -> str:
-    """Convert millisecond timestamp to relative label (Today / Yesterday / Older)."""
-    if not ts_ms:
-        return "Older conversations"
-    import datetime
-    now = datetime.datetime.now()
-    dt = datetime.datetime.fromtimestamp(ts_ms / 1000)
-    delta = (now.date() - dt.date()).days
-    if delta == 0:
-        return "Today"
-    elif delta == 1:
-        return "Yesterday"
-    elif delta <= 7:
-        return "Previous 7 days"
-    else:
-        return "Older conversations"
+    return _group_past_chats(results, datetime.date.today())
+
+
+def _group_past_chats(chats: list, today: datetime.date) -> dict:
+    """
+    Group past chats for the sidebar
+
+    Args:
+        chats: Chat items sorted newest first
+        today: Current local date
+
+    Returns:
+        {time_label: {space_name: [truncated_query, ...]}} in display order
+    """
+    grouped: dict = defaultdict(lambda: defaultdict(list))
+    labels = _format_chat_timestamp([item["timestamp_ms"] for item in chats], today)
+    for item, label in zip(chats, labels):
+        query = item["query"]
+        truncated = (query[:52] + "…") if len(query) > 55 else query
+        grouped[str(label)][item["space_name"]].append(truncated)
+    # Plain dicts so the result can be pickled by st.cache_data
+    return {
+        str(label): dict(grouped[label]) for label in _CHAT_TIME_LABELS if label in grouped
+    }
+
+
+_CHAT_TIME_LABELS = np.array(["Today", "Yesterday", "Previous 7 days", "Older conversations"])
+_MS_PER_DAY = 86_400_000
+
+
+def _format_chat_timestamp(ts_ms, today: datetime.date) -> np.ndarray:
+    """
+    Convert millisecond timestamps to relative labels (Today / Yesterday / Older)
+
+    Args:
+        ts_ms: Sequence of millisecond timestamps (0 / missing -> older)
+        today: Current local date, computed once by the caller
+
+    Returns:
+        Array of labels, one per timestamp
+    """
+    ts = np.asarray(ts_ms, dtype=np.float64)
+    midnight_ms = datetime.datetime.combine(today, datetime.time()).timestamp() * 1000
+    # Whole calendar days before today: 0 for anything since local midnight
+    days_ago = np.ceil((midnight_ms - ts) / _MS_PER_DAY).clip(min=0)
+    buckets = np.digitize(days_ago, [1, 2, 8])
+    buckets[ts <= 0] = len(_CHAT_TIME_LABELS) - 1
+    return _CHAT_TIME_LABELS[buckets]
+
+
+@st.cache_resource
+def _load_css() -> str:
+    """Read the app stylesheet once per server process"""
+    with open(os.path.join(os.path.dirname(__file__), "assets", "app.css")) as f:
+        return f.read()
+
+
+@st.cache_resource
+def _logo_b64(path: str) -> str:
+    """Read and base64-encode the header logo once per server process"""
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode()
 
 
 # Streamlit Page Config
@@ -380,326 +868,41 @@ st.set_page_config(
 )
 
 # Custom CSS - Crunchyroll theme
-st.markdown(
-    """
-<style>
-    /* Import Crunchyroll-like font */
-    @import url('https://fonts.googleapis.com/css2?family=Lato:wght@400;700;900&display=swap');
-    
-    /* Dark background similar to Crunchyroll */
-    .stApp {
-        background-color: #0B0B0B !important;
-        font-family: 'Lato', sans-serif !important;
-    }
-    
-    /* Remove top padding from main block */
-    .block-container {
-        padding-top: 4rem !important;
-    }
-    
-    /* Header styling */
-    .main-header-wrapper {
-        padding: 0.5rem 1rem;
-        border: 2px solid #F47521;
-        background: linear-gradient(135deg, #1a1a1a 0%, #0B0B0B 100%);
-        box-shadow: 0 2px 8px rgba(244, 117, 33, 0.2);
-        display: flex;
-        justify-content: center;
-        align-items: center;
-        width: 100%;
-        margin-bottom: 0rem;
-        margin-top: 0rem;
-    }
-    .main-header-wrapper h1 {
-        background: linear-gradient(90deg, #F47521, #FF8C42);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-        font-size: 1.25rem;
-        font-weight: 700;
-        margin: 0;
-        font-family: 'Lato', sans-serif;
-        letter-spacing: 0.5px;
-    }
-    
-    /* Chat message styling - elegant cards */
-    [data-testid="stChatMessage"] {
-        border-radius: 12px;
-        padding: 20px 24px;
-        margin-bottom: 16px;
-        max-width: 95%;
-        width: 100%;
-        border: none;
-        font-family: 'Lato', sans-serif;
-    }
-    
-    /* Mobile responsive - full width on small screens */
-    @media (max-width: 768px) {
-        [data-testid="stChatMessage"] {
-            max-width: 100%;
-            padding: 16px 20px;
-        }
-    }
-    
-    /* User messages - Crunchyroll orange accent */
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-user"]) {
-        background: linear-gradient(135deg, #F47521 0%, #FF8C42 100%) !important;
-        margin-left: auto;
-        margin-right: 0;
-        box-shadow: 0 4px 12px rgba(244, 117, 33, 0.4);
-    }
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-user"]) p,
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-user"]) div,
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-user"]) span,
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-user"]) * {
-        color: #ffffff !important;
-    }
-    
-    /* Assistant messages - dark with orange accent */
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-assistant"]) {
-        background-color: #1a1a1a !important;
-        margin-right: auto;
-        margin-left: 0;
-        border-left: 3px solid #F47521;
-    }
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-assistant"]) p,
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-assistant"]) div,
-    [data-testid="stChatMessage"]:has([data-testid="chatAvatarIcon-assistant"]) span {
-        color: #ffffff !important;
-    }
-    
-    /* Chart expander styling - Crunchyroll theme */
-    [data-testid="stExpander"] {
-        background-color: #1a1a1a !important;
-        border: 2px solid #F47521 !important;
-        border-radius: 12px !important;
-        margin: 10px 0 !important;
-    }
-    
-    [data-testid="stExpander"] summary {
-        background-color: #2a2a2a !important;
-        border-radius: 10px !important;
-        padding: 14px 18px !important;
-        font-weight: 700 !important;
-        font-size: 16px !important;
-        color: #F47521 !important;
-    }
-    
-    [data-testid="stExpander"] summary:hover {
-        background-color: #3a3a3a !important;
-    }
-    
-    [data-testid="stExpander"] div[role="button"] {
-        background-color: transparent !important;
-    }
-    
-    [data-testid="stExpander"] div[role="button"] p {
-        color: #F47521 !important;
-        font-weight: 700 !important;
-    }
-    
-    [data-testid="stExpander"] svg {
-        fill: #F47521 !important;
-    }
-    
-    .streamlit-expanderContent {
-        background-color: #1a1a1a !important;
-        padding: 20px !important;
-    }
-    
-    /* Dataframe styling */
-    [data-testid="stDataFrame"] {
-        background-color: #1a1a1a !important;
-    }
-    
-    /* Button styling - gradient */
-    .stButton>button {
-        background: linear-gradient(135deg, #F47521 0%, #FF8C42 100%);
-        color: white;
-        border-radius: 12px;
-        border: none;
-        padding: 14px 28px;
-        font-weight: 700;
-        font-family: 'Lato', sans-serif;
-        box-shadow: 0 4px 12px rgba(244, 117, 33, 0.3);
-        transition: all 0.3s ease;
-        text-transform: uppercase;
-        letter-spacing: 0.5px;
-    }
-    .stButton>button:hover {
-        background: linear-gradient(135deg, #FF8C42 0%, #F47521 100%);
-        transform: translateY(-2px);
-        box-shadow: 0 4px 12px rgba(244, 117, 33, 0.4);
-    }
-    
-    /* Error message styling */
-    .stAlert {
-        background-color: #3a1810;
-        color: #ffd4cc;
-        border: 2px solid #F47521;
-        border-radius: 12px;
-        padding: 16px;
-        font-family: 'Lato', sans-serif;
-    }
-    
-    /* Text colors for Crunchyroll theme */
-    p, div, span, h1, h2, h3, h4, h5, h6 {
-        color: #ffffff !important;
-        font-family: 'Lato', sans-serif;
-    }
-    
-    /* Code blocks */
-    code {
-        background-color: #2a2a2a !important;
-        color: #F47521 !important;
-        padding: 0.25rem 0.5rem !important;
-        border-radius: 6px !important;
-        font-size: 0.9em !important;
-    }
-    
-    /* Sidebar styling */
-    [data-testid="stSidebar"] {
-        background-color: #1a1a1a !important;
-        border-right: 2px solid #F47521 !important;
-    }
-    
-    [data-testid="stSidebar"] h1, 
-    [data-testid="stSidebar"] h2, 
-    [data-testid="stSidebar"] h3 {
-        color: #F47521 !important;
-        font-family: 'Lato', sans-serif;
-        font-weight: 900;
-        letter-spacing: 0.5px;
-    }
-    
-    /* Chat input styling */
-    [data-testid="stChatInput"] {
-        border-color: #F47521 !important;
-    }
-    
-    [data-testid="stChatInput"]:focus-within {
-        border-color: #FF8C42 !important;
-        box-shadow: 0 0 0 1px #F47521 !important;
-    }
-    
-    [data-testid="stChatInput"] textarea {
-        border-color: #F47521 !important;
-    }
-    
-    [data-testid="stChatInput"] textarea:focus {
-        border-color: #FF8C42 !important;
-        box-shadow: 0 0 0 1px #F47521 !important;
-    }
-    
-    /* Spinner styling */
-    .stSpinner > div {
-        border-top-color: #F47521 !important;
-    }
-    
-    .stSpinner > div > div {
-        border-top-color: #F47521 !important;
-    }
-    
-    /* Trace event styling */
-    .trace-container {
-        margin: 8px 0;
-        padding: 12px 16px;
-        border-radius: 8px;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        animation: slideIn 0.3s ease-out;
-        box-shadow: 0 2px 8px rgba(102, 126, 234, 0.3);
-    }
-    
-    .trace-step {
-        display: flex;
-        align-items: center;
-        gap: 12px;
-        color: white;
-        font-size: 14px;
-        font-weight: 600;
-    }
-    
-    .trace-icon {
-        font-size: 18px;
-        animation: pulse 1.5s infinite;
-    }
-    
-    .trace-completed {
-        background: linear-gradient(135deg, #11998e 0%, #38ef7d 100%);
-        box-shadow: 0 2px 8px rgba(56, 239, 125, 0.3);
-    }
-    
-    .trace-error {
-        background: linear-gradient(135deg, #eb3349 0%, #f45c43 100%);
-        box-shadow: 0 2px 8px rgba(235, 51, 73, 0.3);
-    }
-    
-    .trace-details {
-        font-size: 12px;
-        opacity: 0.95;
-        margin-top: 4px;
-        font-weight: 400;
-    }
-    
-    @keyframes slideIn {
-        from {
-            opacity: 0;
-            transform: translateY(-10px);
-        }
-        to {
-            opacity: 1;
-            transform: translateY(0);
-        }
-    }
-    
-    @keyframes pulse {
-        0%, 100% { 
-            transform: scale(1);
-            opacity: 1;
-        }
-        50% { 
-            transform: scale(1.1);
-            opacity: 0.8;
-        }
-    }
-</style>
-""",
-    unsafe_allow_html=True,
-)
+st.markdown(f"<style>{_load_css()}</style>", unsafe_allow_html=True)
 
 # Helper function to render trace events
-def render_trace(trace_data: dict):
-    """Render a trace event in the UI with animated styling"""
-    step = trace_data.get("step", "Processing")
-    status = trace_data.get("status", "in_progress")
-    details = trace_data.get("details", "")
-    
-    # Choose icon and CSS class based on status
-    if status == "in_progress":
-        icon = "⏳"
-        css_class = ""
-    elif status == "completed":
-        icon = "✅"
-        css_class = "trace-completed"
-    else:
-        icon = "❌"
-        css_class = "trace-error"
-    
-    # Render trace HTML
-    trace_html = f"""
+# Icon and CSS class per trace status; any other status renders as an error
+_TRACE_STYLES = {
+    "in_progress": ("⏳", ""),
+    "completed": ("✅", "trace-completed"),
+}
+_TRACE_ERROR_STYLE = ("❌", "trace-error")
+_TRACE_TEMPLATE = """
     <div class="trace-container {css_class}">
         <div class="trace-step">
             <span class="trace-icon">{icon}</span>
             <strong>{step}</strong>
         </div>
-        {f'<div class="trace-details">{details}</div>' if details else ''}
+        {details}
     </div>
     """
-    
-    return trace_html
+
+
+def render_trace(trace_data: dict):
+    """Render a trace event in the UI with animated styling"""
+    details = trace_data.get("details", "")
+    icon, css_class = _TRACE_STYLES.get(trace_data.get("status", "in_progress"), _TRACE_ERROR_STYLE)
+    return _TRACE_TEMPLATE.format(
+        css_class=css_class,
+        icon=icon,
+        step=trace_data.get("step", "Processing"),
+        details=f'<div class="trace-details">{details}</div>' if details else "",
+    )
 
 # Sidebar — Past Chats
-with st.sidebar:
+@st.fragment
+def _render_sidebar():
+    """Render the past chats sidebar; as a fragment it reruns on its own"""
     st.markdown(
         """
         <style>
@@ -799,51 +1002,45 @@ with st.sidebar:
             unsafe_allow_html=True,
         )
         # Parallel fetch (cached 5 min by @st.cache_data)
-        past_chats = fetch_past_chats(user_token, GENIE_SPACES)
+        past_chats = fetch_past_chats(user_token, GENIE_SPACES, user_email)
         st.session_state.past_chats_cache = past_chats
         chats_placeholder.empty()
     else:
         past_chats = st.session_state.past_chats_cache
         chats_placeholder.empty()
 
-    def _render_chats(chats):
-        if not chats:
+    def _render_chats(grouped):
+        if not grouped:
             st.markdown(
                 '<div style="color:#555;font-size:0.82rem;padding:1rem 0;">No past conversations found.</div>',
                 unsafe_allow_html=True,
             )
             return
-        time_order = ["Today", "Yesterday", "Previous 7 days", "Older conversations"]
-        grouped: dict = defaultdict(lambda: defaultdict(list))
-        for item in chats:
-            label = _format_chat_timestamp(item["timestamp_ms"])
-            grouped[label][item["space_name"]].append(item["query"])
-        for time_label in time_order:
-            if time_label not in grouped:
-                continue
-            st.markdown(f'<div class="chat-section-label">{time_label}</div>', unsafe_allow_html=True)
-            for space_name, queries in grouped[time_label].items():
-                for query in queries:
-                    truncated = (query[:52] + "…") if len(query) > 55 else query
-                    st.markdown(
+        # One st.markdown element for the whole list instead of one per chat
+        html_parts = []
+        for time_label, spaces in grouped.items():
+            html_parts.append(f'<div class="chat-section-label">{time_label}</div>')
+            for space_name, queries in spaces.items():
+                for truncated in queries:
+                    html_parts.append(
                         f'<div class="chat-item">'
                         f'<span class="space-badge">{space_name}</span>'
                         f'{truncated}'
-                        f'</div>',
-                        unsafe_allow_html=True,
+                        f'</div>'
                     )
+        st.markdown("".join(html_parts), unsafe_allow_html=True)
 
     _render_chats(past_chats)
 
 
+with st.sidebar:
+    _render_sidebar()
 
 # Header with Crunchyroll logo
 logo_path = os.path.join(os.path.dirname(__file__), "assets", "CR-LOGO-RGB-HORIZONTAL-REGISTERED_Orange.png")
 if os.path.exists(logo_path):
     # Center the logo with custom HTML/CSS
-    with open(logo_path, "rb") as f:
-        import base64
-        logo_base64 = base64.b64encode(f.read()).decode()
+    logo_base64 = _logo_b64(logo_path)
     
     st.markdown(
         f"""
@@ -870,125 +1067,110 @@ if not client_initialized:
 else:
     # Initialize session state
     if "messages" not in st.session_state:
-        st.session_state.messages = []
-        print("[UI] Initialized empty messages list")
+        # Bounded history: every rerun walks it, so cap it at the most recent messages
+        st.session_state.messages = deque(maxlen=MAX_HISTORY_MESSAGES)
+        logger.debug("[UI] Initialized empty messages list")
     
     if "is_processing" not in st.session_state:
         st.session_state.is_processing = False
 
     if not st.session_state.messages:
-        # Derive display name from email: "abc.fds@some.com" → "Abc Fds"
-        try:
-            local_part = user_email.split("@")[0]
-            display_name = " ".join(part.capitalize() for part in local_part.replace(".", " ").replace("_", " ").split())
-        except Exception:
-            display_name = "there"
         st.session_state.messages.append(
             {
                 "role": "assistant",
-                "content": f"Hi {display_name}! Ask me anything about your data to get started.",
+                "content": f"Hi {_display_name(user_email)}! Ask me anything about your data to get started.",
+                "msg_id": uuid.uuid4().hex,
                 "table_data": None,
                 "charts": None,
                 "sql": None,
             }
         )
-        print("[UI] Added welcome message")
+        logger.debug("[UI] Added welcome message")
 
-    print(f"[UI] Starting to display {len(st.session_state.messages)} messages")
+    logger.debug("[UI] Starting to display %d messages", len(st.session_state.messages))
     
     # Display message history
-    for idx, message in enumerate(st.session_state.messages):
-        print(f"[UI] Displaying message {idx}: role={message['role']}, content_length={len(message['content'])}")
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-
-            # Display SQL if present and ENV is dev
-            if ENV == "dev" and message.get("sql"):
-                with st.expander("🔍 SQL Query", expanded=False):
-                    st.code(message["sql"], language="sql")
-
-            # Display table data if present
-            if message.get("table_data"):
-                table_data = message["table_data"]
-                with st.expander("Table Data", expanded=True):
-                    df = pd.DataFrame(table_data["data"], columns=table_data["columns"])
-                    st.dataframe(df)
-
-            # Display charts if present
-            if message.get("charts"):
-                for idx, chart_info in enumerate(message["charts"]):
-                    chart_type = chart_info.get("chart_type", "unknown")
-                    plotly_json = chart_info.get("plotly_json")
-
-                    if plotly_json:
-                        # Generate unique key for this chart
-                        msg_idx = st.session_state.messages.index(message)
-                        chart_key = f"chart_{msg_idx}_{idx}"
-
-                        try:
-                            # Use plotly.io.from_json with skip_invalid to handle version incompatibilities
-                            fig_json_str = json.dumps(plotly_json)
-                            fig = pio.from_json(fig_json_str, skip_invalid=True)
-                            
-                            # Fix chart formatting issues
-                            fig = fix_chart_formatting(fig)
-                            
-                            # Skip if chart was filtered out (single data point)
-                            if fig is None:
-                                continue
-
-                            with st.expander(
-                                f"{chart_type.capitalize()} Chart", expanded=True
-                            ):
-                                # Update layout for Crunchyroll theme
-                                fig.update_layout(
-                                    plot_bgcolor="#1a1a1a",
-                                    paper_bgcolor="#1a1a1a",
-                                    font=dict(
-                                        color="#ffffff", size=14, family="Lato, sans-serif"
-                                    ),
-                                    title_font=dict(
-                                        color="#F47521",
-                                        size=18,
-                                        family="Lato, sans-serif",
-                                        weight="bold",
-                                    ),
-                                    xaxis=dict(
-                                        gridcolor="#333333",
-                                        zerolinecolor="#F47521",
-                                        color="#ffffff",
-                                        title_font=dict(
-                                            size=14, color="#F47521", weight="bold"
-                                        ),
-                                        tickfont=dict(size=12, color="#ffffff"),
-                                    ),
-                                    yaxis=dict(
-                                        gridcolor="#333333",
-                                        zerolinecolor="#F47521",
-                                        color="#ffffff",
-                                        title_font=dict(
-                                            size=14, color="#F47521", weight="bold"
-                                        ),
-                                        tickfont=dict(size=12, color="#ffffff"),
-                                    ),
-                                )
+    @st.fragment
+    def _render_history():
+        """Render the stored conversation; as a fragment it can rerun without the chat input"""
+        # Themed chart dicts and table DataFrames per (msg_id, ...) — a stored message never changes
+        chart_cache = st.session_state.setdefault("_chart_cache", {})
+        msgs = st.session_state.messages
+        last_idx = len(msgs) - 1
 
-                                st.plotly_chart(
-                                    fig, use_container_width=True, key=chart_key
-                                )
-                        except Exception as e:
-                            print(f"Error displaying chart: {e}")
+        if len(msgs) == msgs.maxlen:
+            # Drop cached figures/tables of messages that fell out of the history window
+            live_ids = {message.get("msg_id") for message in msgs}
+            for key in [key for key in chart_cache if key[0] not in live_ids]:
+                del chart_cache[key]
+
+        for idx, message in enumerate(msgs):
+            msg_id = message.setdefault("msg_id", uuid.uuid4().hex)
+            is_latest = idx == last_idx
+            logger.debug(
+                "[UI] Displaying message %d: role=%s, content_length=%d",
+                idx, message["role"], len(message["content"]),
+            )
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
+                # Display SQL if present and ENV is dev
+                if ENV == "dev" and message.get("sql"):
+                    with st.expander("🔍 SQL Query", expanded=False):
+                        st.code(message["sql"], language="sql")
+
+                # Display table data if present
+                if message.get("table_data"):
+                    table_data = message["table_data"]
+                    with st.expander("Table Data", expanded=True):
+                        st.dataframe(_table_frame(chart_cache, msg_id, table_data))
+
+                # Display charts if present
+                if message.get("charts"):
+                    for chart_idx, chart_info in enumerate(message["charts"]):
+                        chart_type = chart_info.get("chart_type", "unknown")
+                        plotly_json = chart_info.get("plotly_json")
+
+                        if plotly_json:
+                            # Generate unique key for this chart
+                            chart_key = f"chart_{msg_id}_{chart_idx}"
+
+                            try:
+                                fig_dict = _themed_chart(chart_cache, msg_id, chart_idx, chart_info)
+
+                                # Skip if chart was filtered out (single data point)
+                                if fig_dict is None:
+                                    continue
+
+                                with st.expander(
+                                    f"{chart_type.capitalize()} Chart", expanded=is_latest
+                                ):
+                                    # Older charts only build and ship their figure once asked for
+                                    if is_latest or st.toggle("Show chart", key=f"open_{msg_id}_{chart_idx}"):
+                                        # Built unvalidated; Plotly.js ignores properties it doesn't know
+                                        st.plotly_chart(
+                                            _figure_from_payload(fig_dict),
+                                            use_container_width=True,
+                                            key=chart_key,
+                                            config=PLOTLY_CONFIG,
+                                            theme=None,
+                                        )
+                            except Exception as e:
+                                logger.warning("Error displaying chart: %s", e)
+
+    _render_history()
 
     # Chat input
     if prompt := st.chat_input("What is your question?"):
-        print(f"[UI] User entered prompt: {prompt}")
-        print(f"[UI] Current messages count: {len(st.session_state.messages)}")
+        msgs = st.session_state.messages
+        logger.debug("[UI] User entered prompt: %s", prompt)
+        logger.debug("[UI] Current messages count: %d", len(msgs))
         
         # Add user message to state
-        st.session_state.messages.append(
-            {"role": "user", "content": prompt, "table_data": None, "charts": None}
+        msgs.append(
+            {"role": "user", "content": prompt, "table_data": None, "charts": None, "msg_id": uuid.uuid4().hex}
         )
-        print(f"[UI] Added user message to state. New count: {len(st.session_state.messages)}")
+        logger.debug("[UI] Added user message to state. New count: %d", len(msgs))
 
         # Display user message immediately
         with st.chat_message("user"):
@@ -1004,12 +1186,29 @@ else:
             response_container = st.empty()
             
             try:
-                print("[UI] Starting streaming query")
+                logger.debug("[UI] Starting streaming query")
                 
                 # Track active traces and their order
                 active_traces = {}
+                trace_html = {}  # Rendered HTML per step, rebuilt only when that step changes
                 trace_order = []
+                # Latest throttled update per step since the last flush. New steps and
+                # status changes are flushed as they arrive, so this only ever holds
+                # repeats of what the panel already shows
+                pending_traces = {}
                 final_response = None
+                last_flush = 0.0
+
+                def flush_traces():
+                    """Apply queued trace events and redraw the trace panel in one write"""
+                    for step, event in pending_traces.items():
+                        active_traces[step] = event
+                        trace_html[step] = render_trace(event)
+                    pending_traces.clear()
+                    trace_container.markdown(
+                        "".join(trace_html[s] for s in trace_order),
+                        unsafe_allow_html=True,
+                    )
                 
                 # Stream response with trace events - pass session_id
                 for chunk in agent.query_stream(
@@ -1019,49 +1218,45 @@ else:
                 ):
                     try:
                         # Parse chunk as JSON
-                        chunk_obj = json.loads(chunk)
+                        chunk_obj = orjson.loads(chunk)
                         
                         # Check if it's a trace event
                         if chunk_obj.get("type") == "trace":
                             step = chunk_obj.get("step")
-                            status = chunk_obj.get("status")
                             
-                            print(f"[UI] Trace event: {step} - {status}")
-                            
-                            # Track trace order
+                            # Track trace order (a new step is always flushed, so
+                            # it can't already be waiting in the queue)
                             if step not in active_traces:
                                 trace_order.append(step)
                             
-                            # Update trace data
-                            active_traces[step] = chunk_obj
-                            
-                            # Render all active traces in order
-                            all_traces_html = ""
-                            for trace_step in trace_order:
-                                if trace_step in active_traces:
-                                    all_traces_html += render_trace(active_traces[trace_step])
+                            # Queue the event; only the latest one per step gets rendered
+                            pending_traces[step] = chunk_obj
                             
-                            # Update the trace container
-                            trace_container.markdown(all_traces_html, unsafe_allow_html=True)
-                            
-                            # Add delay to show step-by-step progress
-                            if status == "in_progress":
-                                time.sleep(0.3)  # Pause to show in-progress state
-                            elif status == "completed":
-                                time.sleep(0.5)  # Longer pause to show completion
+                            # Show a new step or a status change right away, since the
+                            # next chunk may be many seconds off; only repeated updates of
+                            # the same step and status wait for TRACE_FLUSH_INTERVAL
+                            shown = active_traces.get(step)
+                            changed = shown is None or shown.get("status") != chunk_obj.get("status")
+                            now = time.monotonic()
+                            if changed or now - last_flush >= TRACE_FLUSH_INTERVAL:
+                                flush_traces()
+                                last_flush = now
                         
                         # Check if it's the final response
                         elif "response" in chunk_obj:
-                            print(f"[UI] Received final response")
+                            logger.debug("[UI] Received final response")
                             final_response = chunk_obj
                             break
                     
-                    except json.JSONDecodeError:
+                    except orjson.JSONDecodeError:
                         # Not JSON, might be plain text
-                        print(f"[UI] Non-JSON chunk received: {chunk[:100]}")
+                        logger.debug("[UI] Non-JSON chunk received: %s", chunk[:100])
                         continue
                 
-                # Keep traces visible for a moment before clearing
+                # Show any events still queued, then keep the traces visible
+                # for a moment before clearing
+                if pending_traces:
+                    flush_traces()
                 if active_traces:
                     time.sleep(0.8)
                 
@@ -1070,9 +1265,14 @@ else:
                 
                 # Display final response
                 if final_response:
+                    msg_id = uuid.uuid4().hex
+                    chart_cache = st.session_state.setdefault("_chart_cache", {})
                     response_text = final_response.get("response", "")
                     charts = final_response.get("charts", [])
                     table_data = final_response.get("table_data")
+                    # Streamed responses carry the table already built, so cap it here
+                    if table_data and len(table_data.get("data") or ()) > MAX_TABLE_ROWS:
+                        table_data = {**table_data, "data": table_data["data"][:MAX_TABLE_ROWS]}
                     sql_query = final_response.get("sql")
                     
                     # Display response text
@@ -1090,42 +1290,19 @@ else:
                             try:
                                 plotly_json = chart.get("plotly_json")
                                 if plotly_json:
-                                    fig_json_str = json.dumps(plotly_json)
-                                    fig = pio.from_json(fig_json_str, skip_invalid=True)
-                                    
-                                    # Fix chart formatting issues
-                                    fig = fix_chart_formatting(fig)
+                                    # Formats and themes once; the history render reuses the result
+                                    fig_dict = _themed_chart(chart_cache, msg_id, i, chart)
                                     
                                     # Skip if chart was filtered out (single data point)
-                                    if fig is None:
+                                    if fig_dict is None:
                                         continue
                                     
-                                    # Apply Crunchyroll theme
-                                    fig.update_layout(
-                                        plot_bgcolor="#1a1a1a",
-                                        paper_bgcolor="#1a1a1a",
-                                        font=dict(color="#ffffff", size=14, family="Lato, sans-serif"),
-                                        title_font=dict(color="#F47521", size=18, family="Lato, sans-serif", weight="bold"),
-                                        xaxis=dict(
-                                            gridcolor="#333333",
-                                            zerolinecolor="#F47521",
-                                            color="#ffffff",
-                                            title_font=dict(size=14, color="#F47521", weight="bold"),
-                                            tickfont=dict(size=12, color="#ffffff"),
-                                        ),
-                                        yaxis=dict(
-                                            gridcolor="#333333",
-                                            zerolinecolor="#F47521",
-                                            color="#ffffff",
-                                            title_font=dict(size=14, color="#F47521", weight="bold"),
-                                            tickfont=dict(size=12, color="#ffffff"),
-                                        ),
-                                    )
-                                    
                                     st.plotly_chart(
-                                        fig,
+                                        _figure_from_payload(fig_dict),
                                         use_container_width=True,
-                                        key=f"chart_{len(st.session_state.messages)}_{i}"
+                                        key=f"chart_{msg_id}_{i}",
+                                        config=PLOTLY_CONFIG,
+                                        theme=None,
                                     )
                             except Exception as e:
                                 st.error(f"Error displaying chart: {e}")
@@ -1134,56 +1311,59 @@ else:
                     if table_data and table_data.get("data"):
                         with st.expander("📊 View Data Table", expanded=False):
                             try:
-                                df = pd.DataFrame(
-                                    table_data.get("data", []),
-                                    columns=table_data.get("columns", [])
+                                # Built once here; the history render reuses the same frame
+                                st.dataframe(
+                                    _table_frame(chart_cache, msg_id, table_data),
+                                    use_container_width=True,
                                 )
-                                st.dataframe(df, use_container_width=True)
                             except Exception as e:
                                 st.error(f"Error displaying table: {e}")
                     
                     # Store in session state
-                    st.session_state.messages.append({
+                    msgs.append({
                         "role": "assistant",
                         "content": response_text,
                         "charts": charts,
                         "table_data": table_data,
-                        "sql": sql_query
+                        "sql": sql_query,
+                        "msg_id": msg_id,
                     })
                 else:
                     # No response received
                     error_msg = "⚠️ No response received from agent"
                     response_container.warning(error_msg)
-                    st.session_state.messages.append({
+                    msgs.append({
                         "role": "assistant",
                         "content": error_msg,
                         "charts": None,
                         "table_data": None,
-                        "sql": None
+                        "sql": None,
+                        "msg_id": uuid.uuid4().hex,
                     })
                 
                 # Reset processing state
                 st.session_state.is_processing = False
 
             except Exception as e:
-                print(f"[UI ERROR] Exception occurred: {str(e)}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("[UI ERROR] Exception occurred: %s", e)
                 
                 # Clear traces on error
                 trace_container.empty()
                 
                 error_msg = f"❌ Error: {str(e)}"
                 response_container.error(error_msg)
-                st.session_state.messages.append({
+                msgs.append({
                     "role": "assistant",
                     "content": error_msg,
                     "table_data": None,
-                    "charts": None
+                    "charts": None,
+                    "msg_id": uuid.uuid4().hex,
                 })
                 
                 # Reset processing state on error
                 st.session_state.is_processing = False
 
-        print("[UI] About to call st.rerun()")
+        # Rerun so the new turn is drawn by the history fragment; otherwise a later
+        # fragment rerun would draw it again below the copy rendered inline here
+        logger.debug("[UI] About to call st.rerun()")
         st.rerun()